@@ -1,7 +1,21 @@
 """
 Handling the AI moves.
 """
+import functools
+import json
+import operator
+import multiprocessing
+import os
 import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+import ChessBook
+import ChessTablebase
+from ChessEngine import ALL_MOVES, CAPTURE_MOVES, QUIET_MOVES, ENPASSANT_MOVE, FIFTY_MOVE_PLIES, MOVE_ID_MASK, \
+    PIECE_CODES, PIECE_INDEX, PIECES, PROMOTION_MOVE, PROMOTION_PIECES, GameState, Move
 
 pieceScore = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "P": 1}
 
@@ -61,34 +75,888 @@ piecePositionScores = {"wN": knightScores,
                          "wP": pawnScores,
                          "bP": pawnScores[::-1]}
 
+# the same scores per piece and square index, in the form GameState.setEvaluationTables keeps totals with
+materialValues = {piece: pieceScore[piece[1]] for piece in
+                  ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")}
+positionValues = {piece: [piecePositionScores[piece][square // 8][square % 8] if piece[1] != "K" else 0
+                          for square in range(64)] for piece in materialValues}
+# (positionValues it was made from, (13, 64) array of each piece's value on each square, negative for black,
+# with a row per PIECE_CODES index) for scorePlanes and scoreLeaves
+batchWeights = None
+np = None  # numpy, imported by importNumpy on first use: it is optional and slow to import
+pieceBitboardsOf = operator.itemgetter(*PIECES)  # a GameState.pieceBitboards dict to a tuple in PIECES order
+
 CHECKMATE = 1000
 STALEMATE = 0
+TABLEBASE_WIN = CHECKMATE - 1  # a tablebase win scores just under a mate on the board, less for every ply to mate
 DEPTH = 3
+MAX_DEPTH = 64  # iterative deepening never goes deeper than this
+DELTA_MARGIN = 2  # quiescence skips captures that cannot bring the score within this much of alpha
+STOP_CHECK_INTERVAL = 64  # nodes searched between looks at the clock
+MAX_PLY = 128  # plies from the root, quiescence included, that get their own move buffers
+HASH_SIZE_MB = 16
+SEARCH_WORKERS = os.cpu_count() or 1  # processes findBestMoveParallel uses unless told otherwise
+
+# transposition table bound types
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the real score is at least the stored one
+UPPER_BOUND = 2  # the search failed low, the real score is at most the stored one
+
+
+class TranspositionTable:
+    """
+    Fixed size table of search results keyed by GameState.zobristKey.
+    Each slot holds the depth, score, bound type and best move (as a moveID) of one position.
+    A slot is only overwritten by a search of at least the same depth, unless the entry is left
+    over from an earlier call to findBestMove, so the deep results of the current search survive.
+    """
+    ENTRY_BYTES = 128  # measured CPython cost of one filled slot across the lists below
+
+    def __init__(self, sizeMB=HASH_SIZE_MB):
+        slots = max(1, int(sizeMB * 1024 * 1024) // self.ENTRY_BYTES)
+        self.size = 1 << (slots.bit_length() - 1)  # round down to a power of two so a mask picks the slot
+        self.mask = self.size - 1
+        self.keys = [None] * self.size
+        self.depths = [0] * self.size
+        self.scores = [0] * self.size
+        self.flags = [EXACT] * self.size
+        self.moves = [None] * self.size
+        self.ages = [0] * self.size
+        self.age = 0
+
+    def newSearch(self):
+        """
+        Mark every stored entry as old, so it is the first to be replaced
+        """
+        self.age += 1
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = None
+            self.moves[i] = None
+        self.age = 0
+
+    def probe(self, key):
+        """
+        Returns (depth, score, flag, moveID) stored for the position, or None
+        """
+        i = key & self.mask
+        if self.keys[i] != key:
+            return None
+        return self.depths[i], self.scores[i], self.flags[i], self.moves[i]
+
+    def store(self, key, depth, score, flag, moveID):
+        i = key & self.mask
+        if self.keys[i] is not None and self.keys[i] != key and self.ages[i] == self.age \
+                and self.depths[i] > depth:
+            return  # depth preferred: keep the deeper result from this search
+        if moveID is None and self.keys[i] == key:
+            moveID = self.moves[i]  # keep the old best move if this search did not find one
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.flags[i] = flag
+        self.moves[i] = moveID
+        self.ages[i] = self.age
+
+
+transpositionTable = TranspositionTable()
+
+
+class MoveOrderingPolicy:
+    """
+    Decides the order the search tries moves in. This base policy only puts the hash move first.
+    Any object with these three methods can be assigned to ChessAI.moveOrdering. Moves are the
+    packed ints of ChessEngine, their moveID is move & MOVE_ID_MASK.
+    """
+
+    def newSearch(self):
+        pass
+
+    def orderMoves(self, moves, ply, hashMoveID):
+        """
+        Returns the moves in the order to search them (the list may be sorted in place)
+        """
+        if hashMoveID is not None:
+            for i in range(len(moves)):
+                if moves[i] & MOVE_ID_MASK == hashMoveID:
+                    moves.insert(0, moves.pop(i))
+                    break
+        return moves
+
+    def recordCutoff(self, move, depth, ply):
+        """
+        Called with the move that caused a beta cutoff
+        """
+        pass
+
+
+class KillerHistoryOrdering(MoveOrderingPolicy):
+    """
+    Hash move first, then captures and promotions by MVV-LVA (most valuable victim, least valuable attacker),
+    then the killer moves of this ply, then the other quiet moves by their history score.
+    """
+    HASH_MOVE = 1 << 30
+    CAPTURE = 1 << 28
+    KILLER = 1 << 26
+    HISTORY_LIMIT = 1 << 25  # history scores are halved before they reach the killer band
+    KILLERS_PER_PLY = 2
+
+    def __init__(self):
+        self.killers = [[None] * self.KILLERS_PER_PLY for _ in range(MAX_DEPTH + 1)]
+        self.history = {"w": {}, "b": {}}  # moveID -> score, per color
+
+    def newSearch(self):
+        for killers in self.killers:
+            for i in range(len(killers)):
+                killers[i] = None
+        for history in self.history.values():
+            for moveID in history:
+                history[moveID] //= 2  # keep what was learnt but let this search outweigh it
+
+    def orderMoves(self, moves, ply, hashMoveID):
+        killers = self.killers[ply]
+        if len(moves) == 0:
+            return moves
+        history = self.history[PIECE_CODES[moves[0] >> 16 & 15][0]]
+
+        def moveScore(move):
+            moveID = move & MOVE_ID_MASK
+            if moveID == hashMoveID:
+                return self.HASH_MOVE
+            if move >> 20 or move >> 14 & 3 == PROMOTION_MOVE:  # a capture or promotion
+                return self.CAPTURE + mvvLvaScore(move)
+            if moveID in killers:
+                return self.KILLER - killers.index(moveID)
+            return history.get(moveID, 0)
+
+        moves.sort(key=moveScore, reverse=True)
+        return moves
+
+    def recordCutoff(self, move, depth, ply):
+        if move >> 20 or move >> 14 & 3 == PROMOTION_MOVE:
+            return  # captures are already ordered well by MVV-LVA
+        moveID = move & MOVE_ID_MASK
+        killers = self.killers[ply]
+        if killers[0] != moveID:
+            killers.pop()
+            killers.insert(0, moveID)
+        history = self.history[PIECE_CODES[move >> 16 & 15][0]]
+        history[moveID] = history.get(moveID, 0) + depth * depth
+        if history[moveID] >= self.HISTORY_LIMIT:
+            for moveID in history:
+                history[moveID] //= 2
+
+
+moveOrdering = KillerHistoryOrdering()
+
+victimValues = {"-": 0, "P": 1, "N": 3, "B": 3, "R": 5, "Q": 10, "K": 0}
+attackerValues = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 10, "K": 20}
+
+
+def mvvLvaScore(move):
+    """
+    Most valuable victim first, least valuable attacker breaks ties.
+    A promotion counts as winning the piece promoted to.
+    """
+    victim = victimValues[PIECE_CODES[move >> 20][1]]
+    if move >> 14 & 3 == PROMOTION_MOVE:
+        victim += victimValues[PROMOTION_PIECES[move >> 12 & 3]]
+    return 100 * victim - attackerValues[PIECE_CODES[move >> 16 & 15][1]]
+
+# search limits, shared by the recursion
+rootDepth = DEPTH
+nodeCount = 0
+nextStopCheck = STOP_CHECK_INTERVAL
+searchDeadline = None  # time.perf_counter() value the search has to stop at
+searchNodeLimit = None
+searchStopEvent = None  # an Event that stops the search once set
+searchStopped = False
+# search counters, reset with the limits and read through getSearchStats. They are always kept: each is
+# one integer add next to nodeCount, which a flag test to switch them off would cost as much as
+searchStartTime = 0.0
+searchEndTime = None  # time.perf_counter() when the last search returned, None while it runs
+completedDepth = 0  # deepest iteration the last search finished
+qNodeCount = 0  # the quiescence share of nodeCount
+ttHitCount = 0  # transposition table probes that found the position, quiescence has none
+betaCutoffCount = 0
+firstMoveCutoffCount = 0  # beta cutoffs on the first move searched, the higher the better the move ordering
+phaseTimes = None  # seconds spent in each phase of the search, while the phase timers are on
+phaseDepth = 0  # timed phases running, only the outermost one is timed
+leafBatching = False  # score the leaves below each depth 1 node together, see enableLeafBatching
+# one capture and one quiet move list per ply, emptied and refilled instead of allocating new lists
+moveBuffers = [([], []) for _ in range(MAX_PLY)]
+
+openingBook = None  # a ChessBook.OpeningBook the opening moves are played from without searching
+
+
+def loadOpeningBook(path):
+    """
+    Play book moves from the book file at path, or stop using a book when path is None
+    """
+    global openingBook
+    if openingBook is not None:
+        openingBook.close()
+    openingBook = None if path is None else ChessBook.OpeningBook(path)
+
+
+def getBookMove(gs):
+    """
+    A Move from the opening book for gs, or None when there is no book or the position isn't in it
+    """
+    if openingBook is None:
+        return None
+    move = openingBook.chooseMove(gs)
+    return None if move is None else Move.fromCode(move)
+
+
+tablebases = None  # a ChessTablebase.Tablebases, probed instead of searching once few pieces are left
+
+
+def loadTablebases(directory):
+    """
+    Probe the endgame tables in directory, or stop probing when directory is None
+    """
+    global tablebases
+    if tablebases is not None:
+        tablebases.close()
+    tablebases = None if directory is None else ChessTablebase.Tablebases(directory)
 
 
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove
+def probeTablebases(gs):
+    """
+    The exact score of gs for the side to move, or None when it isn't in the tablebases
+    """
+    result = tablebases.probe(gs)
+    if result is None:
+        return None
+    wdl, plies = result
+    return STALEMATE if wdl == 0 else wdl * (TABLEBASE_WIN - plies / 1000)
+
+
+def getTablebaseMove(gs, validMoves):
+    """
+    The Move of validMoves with the best tablebase result and its score, or None when gs isn't in the tablebases
+    """
+    if tablebases is None or len(validMoves) == 0 or probeTablebases(gs) is None:
+        return None
+    bestMove, bestScore = None, -CHECKMATE
+    for move in validMoves:
+        gs.makeMove(move)
+        score = probeTablebases(gs)
+        gs.undoMove()
+        if score is None:
+            return None
+        if -score > bestScore:
+            bestMove, bestScore = move, -score
+    return bestMove, bestScore
+
+
+def findBestMove(gs, validMoves, returnQueue, timeLimit=None, nodeLimit=None, workers=1):
+    """
+    Search DEPTH plies, or deepen until timeLimit (milliseconds) or nodeLimit runs out when either is given.
+    validMoves are the Move objects of gs.getValidMoves(), the Move picked is put on returnQueue.
+    Positions in the opening book or the tablebases get their move without any search.
+    With more than one worker the root moves are searched in parallel (node limits only apply to one process).
+    """
+    global nextMove, rootDepth, completedDepth, searchEndTime
+    bookMove = getBookMove(gs)
+    if bookMove is not None:
+        returnQueue.put(bookMove)
+        return
+    tablebaseMove = getTablebaseMove(gs, validMoves)
+    if tablebaseMove is not None:
+        returnQueue.put(tablebaseMove[0])
+        return
+    if workers > 1 and nodeLimit is None:
+        returnQueue.put(findBestMoveParallel(gs, validMoves, workers, timeLimit=timeLimit))
+        return
+    if timeLimit is not None or nodeLimit is not None:
+        returnQueue.put(findBestMoveIterative(gs, validMoves, timeLimit, nodeLimit))
+        return
     nextMove = None
-    random.shuffle(validMoves)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE,
+    rootMoves = [move.code for move in validMoves]
+    random.shuffle(rootMoves)  # vary the order of moves the ordering policy scores the same
+    transpositionTable.newSearch()
+    moveOrdering.newSearch()
+    resetSearchLimits(None, None)
+    rootDepth = DEPTH
+    findMoveNegaMaxAlphaBeta(gs, rootMoves, DEPTH, -CHECKMATE, CHECKMATE,
                              1 if gs.whiteToMove else -1)
-    returnQueue.put(nextMove)
+    completedDepth = DEPTH
+    searchEndTime = time.perf_counter()
+    returnQueue.put(None if nextMove is None else Move.fromCode(nextMove))
+
+
+# progress of an iterative search after each finished depth. score is for the side to move,
+# pv the Moves expected from both sides starting with the best move, nps nodes per second
+SearchInfo = namedtuple("SearchInfo", ["depth", "score", "pv", "nodes", "nps"])
+
+
+class SearchStats:
+    """
+    What the last search did, from getSearchStats(). phaseTimes holds the seconds spent in each phase
+    when the phase timers were on (see enablePhaseTimers) and is empty otherwise.
+    """
+
+    def __init__(self, depth, nodes, qNodes, ttHits, betaCutoffs, firstMoveCutoffs, seconds, phaseTimes):
+        self.depth = depth
+        self.nodes = nodes
+        self.qNodes = qNodes
+        self.ttHits = ttHits
+        self.betaCutoffs = betaCutoffs
+        self.firstMoveCutoffs = firstMoveCutoffs
+        self.seconds = seconds
+        self.phaseTimes = phaseTimes
+
+    @property
+    def firstMoveCutoffPercent(self):
+        return 100 * self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    @property
+    def branchingFactor(self):
+        """
+        Effective branching factor: the number of main search nodes is about branchingFactor ** depth
+        """
+        mainNodes = self.nodes - self.qNodes
+        return mainNodes ** (1 / self.depth) if self.depth and mainNodes > 0 else 0.0
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def toDict(self):
+        return {"depth": self.depth, "nodes": self.nodes, "qnodes": self.qNodes, "tthits": self.ttHits,
+                "betacutoffs": self.betaCutoffs, "firstmovecutoffs": round(self.firstMoveCutoffPercent, 1),
+                "branchingfactor": round(self.branchingFactor, 2), "time": round(self.seconds, 3),
+                "nps": self.nps, "phases": {phase: round(seconds, 3) for phase, seconds in self.phaseTimes.items()}}
+
+    def toJSON(self):
+        return json.dumps(self.toDict())
+
+
+def getSearchStats():
+    """
+    The SearchStats of the last search. Apart from the nodes, root moves searched by the process pool
+    of findBestMoveParallel aren't counted.
+    """
+    endTime = time.perf_counter() if searchEndTime is None else searchEndTime
+    return SearchStats(completedDepth, nodeCount, qNodeCount, ttHitCount, betaCutoffCount, firstMoveCutoffCount,
+                       endTime - searchStartTime, dict(phaseTimes or {}))
+
+
+# the GameState methods timed as each phase while the phase timers are on, scoreBoard is timed as evaluation
+TIMED_PHASES = {"movegen": ["getValidMoves", "getLegalMoves", "getPseudoLegalMoves", "getPseudoLegalMove",
+                            "computeLegality", "isLegalMove"],
+                "makemove": ["makeMove"],
+                "undomove": ["undoMove"]}
+
+
+def enablePhaseTimers(enabled=True):
+    """
+    Time move generation, makeMove, undoMove and scoreBoard in every search from now on, or stop timing.
+    The timers wrap those functions while they are on, so there is no timing code left in the search
+    to slow it down when they are off.
+    """
+    global phaseTimes, scoreBoard
+    if enabled == (phaseTimes is not None):
+        return
+    if enabled:
+        phaseTimes = {}
+        for phase, names in TIMED_PHASES.items():
+            for name in names:
+                setattr(GameState, name, timePhase(phase, getattr(GameState, name)))
+        scoreBoard = timePhase("evaluation", scoreBoard)
+    else:
+        for names in TIMED_PHASES.values():
+            for name in names:
+                setattr(GameState, name, getattr(GameState, name).__wrapped__)
+        scoreBoard = scoreBoard.__wrapped__
+        phaseTimes = None
+
+
+def enableLeafBatching(enabled=True):
+    """
+    Score the positions one ply below every depth 1 node in one scoreLeaves call, in every search from now
+    on, instead of with a scoreBoard call in each of them. Those nodes then generate all their moves at once,
+    not in stages, which costs some pruning. Needs numpy. Search worker processes keep their own setting.
+    """
+    global leafBatching
+    if enabled:
+        importNumpy("leaf batching")
+    leafBatching = enabled
+
+
+def timePhase(phase, function):
+    """
+    Wrap function to add the time it takes to phaseTimes[phase], unless it runs inside another timed phase
+    """
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        global phaseDepth
+        if phaseDepth or phaseTimes is None:
+            return function(*args, **kwargs)
+        phaseDepth = 1
+        startTime = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phaseTimes[phase] = phaseTimes.get(phase, 0.0) + time.perf_counter() - startTime
+            phaseDepth = 0
+    return timed
+
+
+def findBestMoveIterative(gs, validMoves, timeLimit=None, nodeLimit=None, maxDepth=MAX_DEPTH,
+                          infoCallback=None, stopEvent=None):
+    """
+    Iterative deepening: search depth 1, 2, 3, ... until the time limit (milliseconds) or node limit runs out,
+    or stopEvent (a threading or multiprocessing Event) is set. Returns the best move of the last depth that
+    finished. The transposition table carries the best move of each depth into the next one, so it is
+    searched first. infoCallback is called with a SearchInfo after every finished depth.
+    Positions in the tablebases are answered from them without searching.
+    """
+    global nextMove, rootDepth, completedDepth, searchEndTime
+    if len(validMoves) == 0:
+        return None
+    tablebaseMove = getTablebaseMove(gs, validMoves)
+    if tablebaseMove is not None:
+        move, score = tablebaseMove
+        if infoCallback is not None:
+            infoCallback(SearchInfo(1, score, [move], 1, 0))
+        return move
+    rootMoves = [move.code for move in validMoves]
+    random.shuffle(rootMoves)
+    transpositionTable.newSearch()
+    moveOrdering.newSearch()
+    resetSearchLimits(timeLimit, nodeLimit, stopEvent)
+    startTime = time.perf_counter()
+    bestMove = rootMoves[0]  # only used when not even depth 1 finishes
+    for depth in range(1, maxDepth + 1):
+        nextMove = None
+        rootDepth = depth
+        score = findMoveNegaMaxAlphaBeta(gs, rootMoves, depth, -CHECKMATE, CHECKMATE,
+                                         1 if gs.whiteToMove else -1)
+        if searchStopped:
+            break
+        if nextMove is not None:
+            bestMove = nextMove
+        completedDepth = depth
+        if infoCallback is not None:
+            pv = [Move.fromCode(move) for move in getPrincipalVariation(gs, bestMove, depth)]
+            nps = int(nodeCount / max(time.perf_counter() - startTime, 1e-6))
+            infoCallback(SearchInfo(depth, score, pv, nodeCount, nps))
+        if abs(score) >= CHECKMATE:
+            break  # the game is decided, searching deeper can't change the move
+    searchEndTime = time.perf_counter()
+    return Move.fromCode(bestMove)
+
+
+def getPrincipalVariation(gs, firstMove, maxLength):
+    """
+    The packed moves expected from both sides after firstMove, found by following the hash moves
+    of the transposition table as far as they stay legal
+    """
+    pv = [firstMove]
+    gs.makeMove(firstMove)
+    while len(pv) < maxLength:
+        entry = transpositionTable.probe(gs.zobristKey)
+        if entry is None or entry[3] is None:
+            break
+        move = gs.getPseudoLegalMove(entry[3])
+        if move is None or not gs.isLegalMove(move, gs.computeLegality()):
+            break
+        gs.makeMove(move)
+        pv.append(move)
+    for _ in pv:
+        gs.undoMove()
+    return pv
+
+
+class SearchWorker:
+    """
+    Runs findBestMoveIterative in a background process so the caller (the GUI frame loop) never waits on it.
+    A SearchInfo arrives on the queue after every finished depth, bestMove is the best move found so far.
+    poll() returns the chosen Move once the search is over, stop() ends it early with the best move so far
+    and cancel() throws the search away. If the process dies without a move, poll() falls back to the best
+    move so far, or a random one, so the caller always gets a move.
+    """
+
+    def __init__(self, gs, validMoves, timeLimit=None, nodeLimit=None, maxDepth=MAX_DEPTH):
+        self.validMoves = validMoves
+        self.queue = multiprocessing.Queue()
+        self.stopEvent = multiprocessing.Event()
+        self.bestMove = None
+        self.lastInfo = None
+        self.process = multiprocessing.Process(target=runSearchWorker, daemon=True,
+                                               args=(gs, validMoves, timeLimit, nodeLimit, maxDepth,
+                                                     self.queue, self.stopEvent))
+        self.process.start()
+
+    def poll(self):
+        """
+        Take in the updates that have arrived, without waiting. Returns the chosen Move when the search
+        has finished and None while it is still running.
+        """
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except Empty:
+                if self.process.exitcode is None:
+                    return None  # still searching
+                try:  # it may have put the move on the queue just before exiting
+                    message = self.queue.get(timeout=0.1)
+                except Empty:
+                    self.process.join()
+                    return self.bestMove if self.bestMove is not None else findRandomMove(self.validMoves)
+            if isinstance(message, SearchInfo):
+                self.lastInfo = message
+                self.bestMove = message.pv[0]
+            else:  # the final move
+                self.process.join()
+                return message
+
+    def stop(self):
+        """
+        Ask the search to finish now, poll() then returns the best move of the last finished depth
+        """
+        self.stopEvent.set()
+
+    def cancel(self):
+        self.stopEvent.set()
+        self.process.terminate()
+        self.process.join()
+
+
+def runSearchWorker(gs, validMoves, timeLimit, nodeLimit, maxDepth, queue, stopEvent):
+    move = getBookMove(gs)
+    if move is not None:
+        queue.put(move)
+        return
+    move = findBestMoveIterative(gs, validMoves, timeLimit, nodeLimit, maxDepth, queue.put, stopEvent)
+    queue.put(move)
+
+
+def findBestMoveParallel(gs, validMoves, workers=None, depth=DEPTH, timeLimit=None):
+    """
+    Split the root moves over a pool of worker processes and return the Move with the best score.
+    The first move is searched here to get an alpha bound, then the workers take the other moves and
+    share the best score so far through a multiprocessing.Value, so every move they start can cut off
+    against it. With timeLimit (milliseconds) it deepens until the time runs out, otherwise it searches depth plies.
+    """
+    global nodeCount, rootDepth, completedDepth, searchEndTime
+    if len(validMoves) == 0:
+        return None
+    executor, sharedAlpha = getSearchPool(workers)
+    rootMoves = [move.code for move in validMoves]
+    random.shuffle(rootMoves)
+    transpositionTable.newSearch()
+    moveOrdering.newSearch()
+    resetSearchLimits(timeLimit, None)
+    # the workers get the deadline as a time.time() value, the one clock every process reads the same
+    deadline = None if timeLimit is None else time.time() + timeLimit / 1000
+    fen = gs.toFEN()
+    # the keys of the positions a repetition could still go back to, since the FEN alone has no history
+    history = gs.zobristKeyLog[max(0, len(gs.zobristKeyLog) - gs.halfmoveClock):]
+    bestMove = rootMoves[0]
+    for currentDepth in range(1, MAX_DEPTH + 1) if timeLimit is not None else (depth,):
+        rootDepth = currentDepth
+        firstScore = scoreRootMove(gs, rootMoves[0], currentDepth, -CHECKMATE)
+        if searchStopped:
+            break
+        sharedAlpha.value = firstScore
+        futures = [executor.submit(searchRootMove, fen, history, move, currentDepth, deadline)
+                   for move in rootMoves[1:]]
+        bestScore, depthBestMove = firstScore, rootMoves[0]
+        finished = True
+        for future in futures:
+            if deadline is not None and time.time() >= deadline:
+                for unfinished in futures:
+                    unfinished.cancel()  # the ones already running stop by themselves at the deadline
+                finished = False
+                break
+            move, score, alpha, nodes = future.result()
+            nodeCount += nodes
+            if score is None:
+                finished = False
+            elif score > alpha and score > bestScore:  # at or below its alpha the score is only a bound
+                bestScore, depthBestMove = score, move
+        if not finished:
+            break
+        bestMove = depthBestMove
+        completedDepth = currentDepth
+        rootMoves.remove(bestMove)
+        rootMoves.insert(0, bestMove)  # search it first at the next depth
+    searchEndTime = time.perf_counter()
+    return Move.fromCode(bestMove)
+
+
+def scoreRootMove(gs, move, depth, alpha):
+    """
+    Score of a root move for the side to move, searched depth plies deep with alpha as the lower bound
+    """
+    gs.makeMove(move)
+    score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -CHECKMATE, -alpha, 1 if gs.whiteToMove else -1)
+    gs.undoMove()
+    return score
+
+
+# the worker processes of findBestMoveParallel: (executor, shared alpha, number of workers)
+searchPool = None
+sharedAlpha = None  # in a worker process, the alpha shared by all workers
+workerSearch = None  # in a worker process, the (FEN, depth) of the root moves it searches now
+
+
+def getSearchPool(workers=None):
+    """
+    The process pool and shared alpha for parallel searches, started on first use and kept for the next moves
+    """
+    global searchPool
+    workers = workers or SEARCH_WORKERS
+    if searchPool is None or searchPool[2] != workers:
+        shutdownSearchPool()
+        alpha = multiprocessing.Value("d", -CHECKMATE)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=initSearchWorker, initargs=(alpha,))
+        searchPool = (executor, alpha, workers)
+    return searchPool[0], searchPool[1]
+
+
+def shutdownSearchPool():
+    global searchPool
+    if searchPool is not None:
+        searchPool[0].shutdown()
+        searchPool = None
+
+
+def initSearchWorker(alpha):
+    global sharedAlpha
+    sharedAlpha = alpha
 
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMoves
+def searchRootMove(fen, history, move, depth, deadline):
+    """
+    Runs in a worker process: score one root move of the position fen, using the shared alpha as the lower bound.
+    history is the end of the game's zobristKeyLog, for finding repetitions of positions played before fen.
+    deadline is the time.time() the whole search has to stop at, or None.
+    Returns (move, score, alpha used, nodes searched), the score is None if the time ran out.
+    """
+    global rootDepth, workerSearch
+    if workerSearch is None or workerSearch[0] != fen:
+        moveOrdering.newSearch()
+    if workerSearch != (fen, depth):  # a new position or iteration, what is stored so far may be replaced
+        transpositionTable.newSearch()
+        workerSearch = (fen, depth)
+    resetSearchLimits(None if deadline is None else max(0.0, (deadline - time.time()) * 1000), None)
+    rootDepth = depth
+    alpha = sharedAlpha.value
+    gs = GameState.fromFEN(fen)
+    gs.zobristKeyLog = history
+    score = scoreRootMove(gs, move, depth, alpha)
+    if searchStopped:
+        return move, None, alpha, nodeCount
+    if score > alpha:
+        with sharedAlpha.get_lock():
+            if score > sharedAlpha.value:
+                sharedAlpha.value = score
+    return move, score, alpha, nodeCount
+
+
+def resetSearchLimits(timeLimit, nodeLimit, stopEvent=None):
+    global nodeCount, nextStopCheck, searchDeadline, searchNodeLimit, searchStopEvent, searchStopped, \
+        searchStartTime, searchEndTime, completedDepth, qNodeCount, ttHitCount, betaCutoffCount, firstMoveCutoffCount
+    nodeCount = 0
+    searchStartTime = time.perf_counter()
+    searchEndTime = None
+    completedDepth = qNodeCount = ttHitCount = betaCutoffCount = firstMoveCutoffCount = 0
+    if phaseTimes is not None:
+        phaseTimes.clear()
+    searchDeadline = None if timeLimit is None else time.perf_counter() + timeLimit / 1000
+    searchNodeLimit = nodeLimit
+    searchStopEvent = stopEvent
+    searchStopped = False
+    nextStopCheck = STOP_CHECK_INTERVAL if nodeLimit is None else min(STOP_CHECK_INTERVAL, nodeLimit)
+
+
+def checkSearchLimits():
+    """
+    Called every STOP_CHECK_INTERVAL nodes (and exactly at the node limit) to see if the search has to stop
+    """
+    global nextStopCheck, searchStopped
+    if searchNodeLimit is not None and nodeCount >= searchNodeLimit:
+        searchStopped = True
+    elif searchDeadline is not None and time.perf_counter() >= searchDeadline:
+        searchStopped = True
+    elif searchStopEvent is not None and searchStopEvent.is_set():
+        searchStopped = True
+    nextStopCheck = nodeCount + STOP_CHECK_INTERVAL
+    if searchNodeLimit is not None:
+        nextStopCheck = min(nextStopCheck, searchNodeLimit)
+
+
+def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier, staticScore=None):
+    global nextMove, nodeCount, ttHitCount, betaCutoffCount, firstMoveCutoffCount
+    nodeCount += 1
+    if nodeCount >= nextStopCheck:
+        checkSearchLimits()
+    # a repetition needs at least 4 reversible plies. Repeating once is enough to call it a draw, since
+    # whatever the side to move could do here it could have done the first time
+    if depth != rootDepth and gs.halfmoveClock >= 4 \
+            and (gs.halfmoveClock >= FIFTY_MOVE_PLIES or gs.isRepetition()):
+        return STALEMATE
+    if tablebases is not None and depth != rootDepth and bin(gs.occupied).count("1") <= tablebases.maxPieces:
+        score = probeTablebases(gs)
+        if score is not None:
+            return score
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+        return quiescenceSearch(gs, alpha, beta, turnMultiplier, rootDepth, staticScore)
+    if validMoves is not None and len(validMoves) == 0:
+        return -CHECKMATE if gs.checkMate else STALEMATE
+    alphaOriginal = alpha
+    ply = rootDepth - depth
+    hashMoveID = None
+    entry = transpositionTable.probe(gs.zobristKey)
+    if entry is not None:
+        ttHitCount += 1
+        entryDepth, entryScore, entryFlag, hashMoveID = entry
+        if entryDepth >= depth and depth != rootDepth:  # the root still has to search to pick nextMove
+            if entryFlag == EXACT:
+                return entryScore
+            elif entryFlag == LOWER_BOUND:
+                alpha = max(alpha, entryScore)
+            else:
+                beta = min(beta, entryScore)
+            if alpha >= beta:
+                return entryScore
+    leafScores = None
+    if depth == 1 and leafBatching:
+        moves, leafScores = getLeafBatch(gs, validMoves, ply, hashMoveID, turnMultiplier)
+    elif validMoves is None:
+        moves = iterSearchMoves(gs, ply, hashMoveID)
+    else:
+        moves = moveOrdering.orderMoves(validMoves, ply, hashMoveID)
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMoveID = None
+    movesSearched = 0
+    for move in moves:
+        movesSearched += 1
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
+        # the child generates its own moves, only as far as it needs them
+        score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier,
+                                          None if leafScores is None else leafScores[movesSearched - 1])
+        gs.undoMove()
+        if searchStopped:
+            return 0  # unfinished, the caller throws this score away
+        if score > maxScore or movesSearched == 1:  # so a move is picked even when every move gets mated
             maxScore = score
-            if depth == DEPTH:
-                nextMoves = move
+            bestMoveID = move & MOVE_ID_MASK
+            if depth == rootDepth:
+                nextMove = move
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            moveOrdering.recordCutoff(move, depth, ply)
+            betaCutoffCount += 1
+            if movesSearched == 1:
+                firstMoveCutoffCount += 1
+            break
+    if movesSearched == 0:
+        # no legal move, and no child has searched since iterSearchMoves found the checks
+        return -CHECKMATE if gs.inCheck else STALEMATE
+    if maxScore <= alphaOriginal:
+        flag = UPPER_BOUND
+    elif maxScore >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transpositionTable.store(gs.zobristKey, depth, maxScore, flag, bestMoveID)
+    return maxScore
+
+
+def iterSearchMoves(gs, ply, hashMoveID):
+    """
+    Yield the legal moves in search order, generating them in stages: the hash move, then the captures,
+    then the quiet moves. A cutoff on an early move saves generating and checking the later ones.
+    """
+    # keep the pins and checks of this position, the searches of earlier moves overwrite gs.legality
+    legality = gs.computeLegality()
+    if hashMoveID is not None:
+        hashMove = gs.getPseudoLegalMove(hashMoveID)
+        if hashMove is not None and gs.isLegalMove(hashMove, legality):
+            yield hashMove
+    for stage, kind in enumerate((CAPTURE_MOVES, QUIET_MOVES)):
+        moves = gs.getPseudoLegalMoves(kind, getMoveBuffer(ply, stage))
+        for move in moveOrdering.orderMoves(moves, ply, None):
+            if move & MOVE_ID_MASK != hashMoveID and gs.isLegalMove(move, legality):
+                yield move
+
+
+def getLeafBatch(gs, validMoves, ply, hashMoveID, turnMultiplier):
+    """
+    The legal moves of a depth 1 node in the usual search order (moveOrdering, hash move first), and the
+    static scores they lead to for the side to move after them, from a single scoreLeaves call
+    """
+    if validMoves is None:
+        legality = gs.computeLegality()
+        validMoves = [move for move in gs.getPseudoLegalMoves(ALL_MOVES, getMoveBuffer(ply, 0))
+                      if gs.isLegalMove(move, legality)]
+    if not validMoves:
+        return validMoves, None
+    moves = moveOrdering.orderMoves(validMoves, ply, hashMoveID)
+    return moves, (scoreLeaves(gs, moves) * -turnMultiplier).tolist()
+
+
+def getMoveBuffer(ply, stage):
+    """
+    The emptied move list of this ply for a generation stage, 0 for captures and 1 for quiet moves
+    """
+    if ply >= MAX_PLY:
+        return []
+    moves = moveBuffers[ply][stage]
+    moves.clear()
+    return moves
+
+
+def quiescenceSearch(gs, alpha, beta, turnMultiplier, ply, staticScore=None):
+    """
+    Keep searching captures until the position is quiet, so the board is never scored in the middle
+    of an exchange. The side to move can always stand pat on the static score instead of capturing,
+    except when in check, where every way out of check is searched. staticScore is that score when the
+    caller already has it from scoreLeaves.
+    """
+    global nodeCount, qNodeCount
+    nodeCount += 1
+    qNodeCount += 1
+    if nodeCount >= nextStopCheck:
+        checkSearchLimits()
+    legality = gs.computeLegality()
+    inCheck = legality[0]
+    if inCheck:
+        moves = gs.getPseudoLegalMoves(ALL_MOVES, getMoveBuffer(ply, 0))
+        standPat = maxScore = -CHECKMATE  # stays this when there is no way out of check
+    else:
+        standPat = maxScore = turnMultiplier * scoreBoard(gs) if staticScore is None else staticScore
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        moves = gs.getPseudoLegalMoves(CAPTURE_MOVES, getMoveBuffer(ply, 0))
+        moves.sort(key=mvvLvaScore, reverse=True)
+    for move in moves:
+        if not inCheck:
+            if move >> 14 & 3 == PROMOTION_MOVE:
+                if move >> 12 & 3:
+                    continue  # under-promotions only matter in quiet positions
+            # delta pruning: skip captures that leave us below alpha even if they win the piece for free
+            elif standPat + pieceScore[PIECE_CODES[move >> 20][1]] + DELTA_MARGIN <= alpha:
+                continue
+        if not gs.isLegalMove(move, legality):  # only checked for the moves that get this far
+            continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, ply + 1)
         gs.undoMove()
+        if searchStopped:
+            return 0
+        if score > maxScore:
+            maxScore = score
         if maxScore > alpha:
             alpha = maxScore
         if alpha >= beta:
@@ -100,12 +968,29 @@ def scoreBoard(gs):
     """
     Score the board. A positive score is good for white, a negative score is good for black.
     """
-    if gs.checkmate:
+    if gs.checkMate:
         if gs.whiteToMove:
             return -CHECKMATE  # black wins
         else:
             return CHECKMATE  # white wins
-    elif gs.stalemate:
+    elif gs.staleMate:
+        return STALEMATE
+
+    if gs.positionValues is not positionValues:
+        gs.setEvaluationTables(materialValues, positionValues)
+    return gs.materialTotals["w"] + gs.positionTotals["w"] - gs.materialTotals["b"] - gs.positionTotals["b"]
+
+
+def scoreBoardFull(gs):
+    """
+    Score the board by scanning every square. Gives the same result as scoreBoard without the incremental totals.
+    """
+    if gs.checkMate:
+        if gs.whiteToMove:
+            return -CHECKMATE  # black wins
+        else:
+            return CHECKMATE  # white wins
+    elif gs.staleMate:
         return STALEMATE
 
     score = 0
@@ -113,18 +998,108 @@ def scoreBoard(gs):
         for col in range(len(gs.board[row])):
             piece = gs.board[row][col]
             if piece != "--":
-                piecePositionScores = 0
+                piecePositionScore = 0
                 if piece[1] != "K":
-                    piecePositionScores = piecePositionScores[piece][row][col]
+                    piecePositionScore = piecePositionScores[piece][row][col]
                 if piece[0] == "w":
-                    score += pieceScore[piece[1]] + piecePositionScores
+                    score += pieceScore[piece[1]] + piecePositionScore
                     #recently changed from piecepositionscore (singular)
                 if piece[0] == "b":
-                    score -= pieceScore[piece[1]] + piecePositionScores
+                    score -= pieceScore[piece[1]] + piecePositionScore
 
     return score
 
 
+def importNumpy(feature):
+    """
+    Import numpy into np, or raise ImportError naming the feature that needs it
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError(feature + " needs numpy (pip install numpy)") from None
+        np = numpy
+
+
+def boardPlanes(states):
+    """
+    Stack the boards of a list of GameStates into an (N, 12, 64) int8 array: one plane per piece in
+    PIECES order, with a 1 on every square (0 = a8) that piece stands on. Needs numpy.
+    """
+    importNumpy("batch evaluation")
+    bitboards = np.array([pieceBitboardsOf(gs.pieceBitboards) for gs in states], dtype="<u8")
+    planes = np.unpackbits(bitboards.reshape(-1, 12).view(np.uint8), axis=1, bitorder="little")
+    return planes.view(np.int8).reshape(-1, 12, 64)
+
+
+def scorePlanes(planes):
+    """
+    Score an (N, 12, 64) array of boardPlanes with one dot product against the material and piece-square
+    tables. Gives the static part of scoreBoard, positive for white, as an array of N floats.
+    """
+    return planes.reshape(-1, 12 * 64) @ getBatchWeights()[1:].reshape(-1)
+
+
+def getBatchWeights():
+    """
+    The (13, 64) weight table of the current evaluation tables, see batchWeights
+    """
+    global batchWeights
+    if batchWeights is None or batchWeights[0] is not positionValues:
+        importNumpy("batch evaluation")
+        weights = np.zeros((len(PIECE_CODES), 64))
+        for i, piece in enumerate(PIECES, 1):
+            weights[i] = [(materialValues[piece] + positionValues[piece][square]) * (1 if piece[0] == "w" else -1)
+                          for square in range(64)]
+        batchWeights = (positionValues, weights)
+    return batchWeights[1]
+
+
+def scoreLeaves(gs, moves):
+    """
+    The scoreBoard scores of the positions the packed moves lead to from gs, as an array, all at once.
+    Worked out from the score of gs and the squares each move changes, so no move is made.
+    """
+    weights = getBatchWeights()
+    codes = np.array(moves, dtype=np.int64)
+    start = codes & 63
+    end = codes >> 6 & 63
+    moved = codes >> 16 & 15
+    captured = codes >> 20
+    scores = scoreBoard(gs) + weights[moved, end] - weights[moved, start] - weights[captured, end]
+    for i in np.flatnonzero(codes >> 14 & 3).tolist():  # the few promotions, en passant captures and castles
+        move = moves[i]
+        kind = move >> 14 & 3
+        startSquare, endSquare = move & 63, move >> 6 & 63
+        color = PIECE_CODES[move >> 16 & 15][0]
+        if kind == PROMOTION_MOVE:
+            promoted = PIECE_INDEX[color + PROMOTION_PIECES[move >> 12 & 3]]
+            scores[i] += weights[promoted, endSquare] - weights[move >> 16 & 15, endSquare]
+        elif kind == ENPASSANT_MOVE:  # the captured pawn is beside the end square, not on it
+            scores[i] += weights[move >> 20, endSquare] - weights[move >> 20, (startSquare & ~7) | (endSquare & 7)]
+        else:
+            rook = PIECE_INDEX[color + "R"]
+            if endSquare - startSquare == 2:  # kingside
+                scores[i] += weights[rook, endSquare - 1] - weights[rook, endSquare + 1]
+            else:
+                scores[i] += weights[rook, endSquare + 1] - weights[rook, endSquare - 2]
+    return scores
+
+
+def scoreBoards(states):
+    """
+    Score a list of GameStates at once, the same as calling scoreBoard on each of them, as a numpy array.
+    Much cheaper than scoreBoardFull for positions that were loaded rather than played into.
+    """
+    scores = scorePlanes(boardPlanes(states))
+    for i, gs in enumerate(states):
+        if gs.checkMate or gs.staleMate:
+            scores[i] = scoreBoard(gs)
+    return scores
+
+
 def findRandomMove(validMoves):
     """
     Picks and returns a random valid move.
@@ -0,0 +1,168 @@
+"""
+Batch analysis of positions from a FEN or EPD file (or stdin) with ChessAI, spread over a process pool.
+Positions are read as a stream and only a bounded number are in flight at once, so memory use stays flat
+however long the input is. One JSON line per position is written as soon as its result arrives:
+
+    {"line": 12, "id": "WAC.001", "fen": "...", "bestmove": "e2e4", "san": "e4", "score": 35, "depth": 4,
+     "nodes": 5120, "time": 0.41}
+
+score is in centipawns for the side to move. Results come out in the order they finish, line tells
+which input line they belong to. --stats adds the search counters of ChessAI.SearchStats, and --timers
+also the time spent in each phase of the search. --batch-leaves searches with ChessAI.enableLeafBatching.
+
+    python ChessAnalyze.py games.epd --depth 4 > analysis.jsonl
+    zcat positions.fen.gz | python ChessAnalyze.py - --movetime 200 --workers 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ChessAI
+import ChessEngine
+
+TASKS_PER_WORKER = 4  # positions queued per worker, enough to keep them busy without reading ahead far
+
+workerState = None  # the GameState each worker process loads every position into
+
+
+def parsePosition(line):
+    """
+    Split a FEN line, or an EPD line with operations, into (FEN, id). None for blank and comment lines.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    fields = line.split(None, 4)
+    if len(fields) < 5 or (";" not in fields[4] and fields[4].replace(" ", "").isdigit()):
+        return line, None  # plain FEN, with or without the move counters
+    fen = " ".join(fields[:4])
+    positionId = None
+    for operation in fields[4].split(";"):
+        opcode, _, operand = operation.strip().partition(" ")
+        if opcode in ("hmvc", "fmvn"):
+            fen += " " + operand.strip()
+        elif opcode == "id":
+            positionId = operand.strip().strip('"')
+    return fen, positionId
+
+
+def iterPositions(lines):
+    """
+    Yield (line number, FEN, id) for every position in lines
+    """
+    for lineNumber, line in enumerate(lines, 1):
+        parsed = parsePosition(line)
+        if parsed is not None:
+            yield lineNumber, parsed[0], parsed[1]
+
+
+def initAnalysisWorker(phaseTimers=False, leafBatching=False):
+    global workerState
+    workerState = ChessEngine.GameState()
+    ChessAI.enablePhaseTimers(phaseTimers)
+    ChessAI.enableLeafBatching(leafBatching)
+
+
+def analyzePosition(lineNumber, fen, positionId, depth=None, timeLimit=None, stats=False):
+    """
+    Runs in a worker process: search one position and return its result as a dict
+    """
+    result = {"line": lineNumber, "id": positionId, "fen": fen}
+    gs = workerState
+    try:
+        gs.loadFEN(fen)
+    except ValueError as error:
+        result["error"] = str(error) or "bad FEN"
+        return result
+    if bin(gs.pieceBitboards["wK"]).count("1") != 1 or bin(gs.pieceBitboards["bK"]).count("1") != 1:
+        result["error"] = "the position needs one king of each color"
+        return result
+    infos = []
+    startTime = time.perf_counter()
+    try:
+        validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            result.update(bestmove=None, san=None, score=None, depth=0, nodes=0, time=0.0,
+                          result="checkmate" if gs.checkMate else "stalemate")
+            return result
+        move = ChessAI.findBestMoveIterative(gs, validMoves, timeLimit, None, depth or ChessAI.MAX_DEPTH,
+                                             infos.append)
+    except Exception as error:  # a position the engine can't handle costs its own line, not the whole run
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+        return result
+    elapsed = time.perf_counter() - startTime
+    last = infos[-1] if infos else None
+    result.update(bestmove=move.getChessNotation(), san=gs.getSAN(move, validMoves),
+                  score=None if last is None else round(last.score * 100),
+                  depth=0 if last is None else last.depth, nodes=ChessAI.nodeCount, time=round(elapsed, 3))
+    if stats:
+        result["stats"] = ChessAI.getSearchStats().toDict()
+    return result
+
+
+def analyzePositions(lines, depth=None, timeLimit=None, workers=None, stats=False, phaseTimers=False,
+                     leafBatching=False):
+    """
+    Yield the analysis of every position in lines (an iterable of FEN or EPD lines, such as an open file)
+    in the order they finish. Searches depth plies, or for timeLimit milliseconds per position.
+    With stats every result includes the search counters, with phaseTimers the phase times too.
+    leafBatching scores the leaves with numpy, see ChessAI.enableLeafBatching.
+    """
+    if depth is None and timeLimit is None:
+        depth = ChessAI.DEPTH
+    workers = workers or os.cpu_count() or 1
+    positions = iterPositions(lines)
+    if workers == 1:
+        initAnalysisWorker(phaseTimers, leafBatching)
+        for lineNumber, fen, positionId in positions:
+            yield analyzePosition(lineNumber, fen, positionId, depth, timeLimit, stats or phaseTimers)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initAnalysisWorker,
+                             initargs=(phaseTimers, leafBatching)) as executor:
+        pending = set()
+        for lineNumber, fen, positionId in positions:
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(analyzePosition, lineNumber, fen, positionId, depth, timeLimit,
+                                        stats or phaseTimers))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze every position of a FEN or EPD file")
+    parser.add_argument("input", nargs="?", default="-", help="FEN/EPD file, - for stdin")
+    limits = parser.add_mutually_exclusive_group()
+    limits.add_argument("--depth", type=int, help="plies to search (default %d)" % ChessAI.DEPTH)
+    limits.add_argument("--movetime", type=int, help="milliseconds to search each position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", metavar="FILE", help="JSON lines file to write instead of stdout")
+    parser.add_argument("--stats", action="store_true", help="add the search counters to every result")
+    parser.add_argument("--timers", action="store_true", help="add the counters and the time of each search phase")
+    parser.add_argument("--batch-leaves", action="store_true", help="score the leaves of the search in numpy batches")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for result in analyzePositions(source, args.depth, args.movetime, args.workers, args.stats, args.timers,
+                                       args.batch_leaves):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
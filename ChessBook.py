@@ -0,0 +1,180 @@
+"""
+Opening book: a file of 16 byte records sorted by position hash, read through mmap with a binary search,
+so looking up a position costs microseconds and every process using the book shares one copy of it
+in the page cache.
+
+The records have the Polyglot layout (big endian key: u64, move: u16, weight: u16, learn: u32), but the key
+is GameState.zobristKey and the move is this engine's moveID (see ChessEngine.MOVE_ID_MASK), so books built
+for other engines can't be read as they are. Build one from games instead:
+
+    python ChessBook.py build games.pgn book.bin --plies 16
+    python ChessBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+
+Games can be PGN (SAN moves, as written by ChessSelfPlay.py) or one game per line in long algebraic
+notation (e2e4 e7e5 ...). A move's weight is the number of games it was played in.
+"""
+import argparse
+import mmap
+import random
+import re
+import struct
+import sys
+
+import ChessEngine
+
+RECORD = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+GAME_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file can't be mapped
+            self.data = b""
+        self.count = len(self.data) // RECORD.size
+
+    def probe(self, key):
+        """
+        The (moveID, weight) entries of the position with this Zobrist key
+        """
+        low, high = 0, self.count
+        while low < high:  # find the first record with this key
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for i in range(low, self.count):
+            recordKey, move, weight, _ = RECORD.unpack_from(self.data, i * RECORD.size)
+            if recordKey != key:
+                break
+            entries.append((move, weight))
+        return entries
+
+    def chooseMove(self, gs, rng=random):
+        """
+        A legal book move for gs as a packed move, picked at random in proportion to the weights, or None
+        """
+        entries = self.probe(gs.zobristKey)
+        if not entries:
+            return None
+        legality = gs.computeLegality()
+        moves = []
+        weights = []
+        for moveID, weight in entries:
+            move = gs.getPseudoLegalMove(moveID)
+            # another position can share the key, so only trust moves that are legal here
+            if weight > 0 and move is not None and gs.isLegalMove(move, legality):
+                moves.append(move)
+                weights.append(weight)
+        if not moves:
+            return None
+        return rng.choices(moves, weights)[0]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+def iterGames(lines):
+    """
+    Yield the move tokens of every game: PGN movetext (without comments or variations) or one game per line
+    """
+    tokens = []
+    inPGN = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            inPGN = True
+            continue
+        line = re.sub(r"\{[^}]*\}|\([^)]*\)", " ", line)
+        for token in line.split():
+            if token in GAME_RESULTS:
+                if tokens:
+                    yield tokens
+                tokens = []
+                continue
+            token = re.sub(r"^\d+\.+", "", token)  # move numbers, also when written as 1.e4
+            if token:
+                tokens.append(token)
+        if not inPGN and tokens:
+            yield tokens
+            tokens = []
+    if tokens:
+        yield tokens
+
+
+def findMove(gs, token):
+    """
+    The legal packed move written as token, in SAN or long algebraic notation, or None
+    """
+    token = token.rstrip("+#!?")
+    validMoves = gs.getLegalMoves()
+    for move in validMoves:
+        if ChessEngine.Move.fromCode(move).getChessNotation() == token.lower() \
+                or gs.getSAN(move, validMoves).rstrip("+#") == token:
+            return move
+    return None
+
+
+def buildBook(lines, path, maxPlies=16, startFen=ChessEngine.START_FEN):
+    """
+    Write a book of the moves played in the first maxPlies plies of the games in lines.
+    Returns the number of games read.
+    """
+    counts = {}
+    games = 0
+    gs = ChessEngine.GameState()
+    for tokens in iterGames(lines):
+        games += 1
+        gs.loadFEN(startFen)
+        for token in tokens[:maxPlies]:
+            move = findMove(gs, token)
+            if move is None:
+                break  # the rest of the game can't be followed
+            entry = (gs.zobristKey, move & ChessEngine.MOVE_ID_MASK)
+            counts[entry] = counts.get(entry, 0) + 1
+            gs.makeMove(move)
+    scale = max(1, (max(counts.values(), default=0) + MAX_WEIGHT - 1) // MAX_WEIGHT)
+    with open(path, "wb") as file:
+        for (key, moveID), count in sorted(counts.items()):
+            file.write(RECORD.pack(key, moveID, max(1, count // scale), 0))
+    return games
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or look into an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    buildParser = commands.add_parser("build", help="build a book from PGN or long algebraic games")
+    buildParser.add_argument("games", help="games file, - for stdin")
+    buildParser.add_argument("book")
+    buildParser.add_argument("--plies", type=int, default=16, help="plies of each game that go into the book")
+    probeParser = commands.add_parser("probe", help="list the book moves of a position")
+    probeParser.add_argument("book")
+    probeParser.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        source = sys.stdin if args.games == "-" else open(args.games)
+        with source:
+            games = buildBook(source, args.book, args.plies)
+        print("%d games written to %s" % (games, args.book))
+    else:
+        book = OpeningBook(args.book)
+        gs = ChessEngine.GameState.fromFEN(args.fen)
+        for moveID, weight in sorted(book.probe(gs.zobristKey), key=lambda entry: -entry[1]):
+            move = gs.getPseudoLegalMove(moveID)
+            if move is not None:
+                print("%s %d" % (gs.getSAN(move), weight))
+        book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,474 +1,1020 @@
-""" STORES INFORMATION """
-
-
-class GameState():
-    def __init__(self):
-        # board is 8x8 2D list, each element of the list has 2 characters
-        # The first character represents the color of the piece, 'b' or 'w'
-        # The second character represents the type of the piece
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        self.moveFunctions = {'P': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
-                              'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
-        self.whiteToMove = True
-        self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
-        self.checkMate = False
-        self.staleMate = False
-        self.inCheck = False
-        self.pins = []
-        self.checks = []
-        self.enpassantPossible = ()  # coordinates for the square where an en passant capture is possible
-        self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs,
-                                             self.currentCastlingRights.bks, self.currentCastlingRights.bqs)]
-
-    def makeMove(self, move):
-        self.board[move.startRow][move.startColumn] = "--"
-        self.board[move.endRow][move.endColumn] = move.pieceMoved
-        self.moveLog.append(move)
-        self.whiteToMove = not self.whiteToMove
-        # update king location
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endColumn)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endColumn)
-
-        # pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endColumn] = move.pieceMoved[0] + 'Q'
-
-        # en passant move
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endColumn] = "--"
-
-        # update en passant variable
-        if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:  # only on 2 sq pawn advances
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.endColumn)
-        else:
-            self.enpassantPossible = ()
-
-        # castle move
-        if move.isCastleMove:
-            if move.endColumn - move.startColumn == 2:  # kingside
-                self.board[move.endRow][move.endColumn - 1] = self.board[move.endRow][move.endColumn + 1]
-                self.board[move.endRow][move.endColumn + 1] = "--"  # erase old rook
-            else:  # queenside
-                self.board[move.endRow][move.endColumn + 1] = self.board[move.endRow][move.endColumn - 2]
-                self.board[move.endRow][move.endColumn - 2] = "--"
-
-        # update castling rights - whenever it is a rook or king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs,
-                                                 self.currentCastlingRights.bks, self.currentCastlingRights.bqs))
-
-    def undoMove(self):
-        if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startColumn] = move.pieceMoved
-            self.board[move.endRow][move.endColumn] = move.pieceCaptured
-            self.whiteToMove = not self.whiteToMove
-            # update the king location
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startColumn)
-            elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startColumn)
-            # undo en passant
-            if move.isEnpassantMove:
-                self.board[move.endRow][move.endColumn] = "--"  # leave landing square blank
-                self.board[move.startRow][move.endColumn] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endColumn)
-
-            # undo a 2 square pawn advance
-            if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-
-            # undo castling rights
-            self.castleRightsLog.pop()  # get rid of new castle rights from the move we are undoing
-            self.currentCastlingRights = self.castleRightsLog[-1]  # set castle rights to the last one in the list
-            # undo castle move
-            if move.isCastleMove:
-                if move.endColumn - move.startColumn == 2:
-                    self.board[move.endRow][move.endColumn + 1] = self.board[move.endRow][move.endColumn - 1]
-                    self.board[move.endRow][move.endColumn - 1] = "--"
-                else:
-                    self.board[move.endRow][move.endColumn - 2] = self.board[move.endRow][move.endColumn + 1]
-                    self.board[move.endRow][move.endColumn + 1] = "--"
-            self.checkMate = False
-            self.staleMate = False
-
-    '''
-    Update the castle rights
-    '''
-
-    def updateCastleRights(self, move):
-        if move.pieceMoved == "wK":
-            self.currentCastlingRights.wqs = False
-            self.currentCastlingRights.wks = False
-        elif move.pieceMoved == "bK":
-            self.currentCastlingRights.bqs = False
-            self.currentCastlingRights.bks = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7:
-                if move.startColumn == 0:  # left rook
-                    self.currentCastlingRights.wqs = False
-                elif move.startColumn == 7:  # right rook
-                    self.currentCastlingRights.wks = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 0:
-                if move.startColumn == 0:  # left rook
-                    self.currentCastlingRights.bqs = False
-                elif move.startColumn == 7:  # right rook
-                    self.currentCastlingRights.bks = False
-
-        if move.pieceCaptured == "wR":
-            if move.endColumn == 0:
-                self.currentCastlingRights.wqs = False
-            elif move.endColumn == 7:
-                self.currentCastlingRights.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endColumn == 0:
-                self.currentCastlingRights.bqs = False
-            elif move.endColumn == 7:
-                self.currentCastlingRights.bks = False
-
-    def getValidMoves(self):
-        tempCastleRights = CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
-                                        self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)
-
-        moves = []
-        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingColumn = self.whiteKingLocation[1]
-        else:
-            kingRow = self.blackKingLocation[0]
-            kingColumn = self.blackKingLocation[1]
-        if self.inCheck:
-            if len(self.checks) == 1:  # only 1 check, block the check or move the king
-                moves = self.getAllPossibleMoves()
-                # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = self.checks[0]  # check information
-                checkRow = check[0]
-                checkColumn = check[1]
-                pieceChecking = self.board[checkRow][checkColumn]
-                validSquares = []  # squares that pieces can move to
-                # if knight, must capture the knight or move your king, other pieces can be blocked
-                if pieceChecking[1] == "N":
-                    validSquares = [(checkRow, checkColumn)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i,
-                                        kingColumn + check[3] * i)  # check[2] and check[3] are the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[
-                            1] == checkColumn:  # once you get to piece and check
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].pieceMoved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].endRow,
-                                moves[i].endColumn) in validSquares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
-            else:  # double check, king has to move
-                self.getKingMoves(kingRow, kingColumn, moves)
-        else:  # not in check - all moves are fine
-            moves = self.getAllPossibleMoves()
-            if self.whiteToMove:
-                self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
-            else:
-                self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-
-        if len(moves) == 0:
-            if self.inCheck:
-                self.checkMate = True
-            else:
-                self.staleMate = True
-        else:
-            self.checkMate = False
-            self.staleMate = False
-
-        self.currentCastlingRights = tempCastleRights
-        return moves
-
-    def inCheck(self):
-        """
-        Determine if a current player is in check
-        """
-        if self.whiteToMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-        else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
-
-    def squareUnderAttack(self, r, c):
-        """ Determine if enemy can attack the square row and column """
-        self.whiteToMove = not self.whiteToMove
-        opponentsMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in opponentsMoves:
-            if move.endRow == r and move.endColumn == c:
-                return True
-        return False
-
-    def getAllPossibleMoves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
-        return moves
-
-    def getPawnMoves(self, r, c, moves):
-        if self.whiteToMove:
-            if self.board[r - 1][c] == "--":
-                moves.append(Move((r, c), (r - 1, c), self.board))
-                if r == 6 and self.board[r - 2][c] == "--":
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r - 1][c - 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board, isEnpassantMove=True))
-            if c + 1 <= 7:
-                if self.board[r - 1][c + 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, isEnpassantMove=True))
-
-        else:  # black pawn moves
-            if self.board[r + 1][c] == "--":
-                moves.append(Move((r, c), (r + 1, c), self.board))
-                if r == 1 and self.board[r + 1][c] == "--":
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r + 1][c - 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board, isEnpassantMove=True))
-            if c + 1 <= 7:
-                if self.board[r + 1][c + 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, isEnpassantMove=True))
-
-    def getRookMoves(self, r, c, moves):
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endColumn = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endColumn < 8:
-                    endPiece = self.board[endRow][endColumn]
-                    if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endColumn), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endColumn), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    def getBishopMoves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endColumn = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endColumn < 8:
-                    endPiece = self.board[endRow][endColumn]
-                    if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endColumn), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endColumn), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    def getKnightMoves(self, r, c, moves):
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endColumn = c + m[1]
-            if 0 < endRow < 8 and 0 <= endColumn < 8:
-                endPiece = self.board[endRow][endColumn]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endColumn), self.board))
-
-    def getKingMoves(self, row, col, moves):
-        """
-        Get all the king moves for the king located at row col and add the moves to the list.
-        """
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        columnMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        allyColor = "w" if self.whiteToMove else "b"
-        for i in range(7):
-            endRow = row + rowMoves[i]
-            endColumn = col + columnMoves[i]
-            if 0 <= endRow <= 7 and 0 <= endColumn <= 7:
-                endPiece = self.board[endRow][endColumn]
-                if endPiece[0] != allyColor:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if allyColor == "w":
-                        self.whiteKingLocation = (endRow, endColumn)
-                    else:
-                        self.blackKingLocation = (endRow, endColumn)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((row, col), (endRow, endColumn), self.board))
-                    # place king back on original location
-                    if allyColor == "w":
-                        self.whiteKingLocation = (row, col)
-                    else:
-                        self.blackKingLocation = (row, col)
-
-        '''
-        Generate all valid castle moves for the king at (r, c) and then add them to the list of moves
-        '''
-
-    def getCastleMoves(self, r, c, moves):
-        if self.inCheck:
-            return  # can't castle while in check
-        if (self.whiteToMove and self.currentCastlingRights.wks) \
-                or (not self.whiteToMove and self.currentCastlingRights.bks):
-            self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRights.wqs) \
-                or (not self.whiteToMove and self.currentCastlingRights.bqs):
-            self.getQueensideCastleMoves(r, c, moves, )
-
-    def getKingsideCastleMoves(self, r, c, moves):
-        if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
-            if not self.squareUnderAttack(r, c + 1) and not self.squareUnderAttack(r, c + 2):
-                moves.append(Move((r, c), (r, c + 2), self.board, isCastleMove=True))
-
-    def getQueensideCastleMoves(self, r, c, moves):
-        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
-            if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-                moves.append(Move((r, c), (r, c - 2), self.board, isCastleMove=True))
-
-    def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
-
-    def checkForPinsAndChecks(self):
-        pins = []
-        checks = []
-        inCheck = False
-        if self.whiteToMove:
-            enemyColor = "b"
-            allyColor = "w"
-            startRow = self.whiteKingLocation[0]
-            startColumn = self.whiteKingLocation[1]
-        else:
-            enemyColor = "w"
-            allyColor = "b"
-            startRow = self.blackKingLocation[0]
-            startColumn = self.blackKingLocation[1]
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = ()  # reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endColumn = startColumn + d[1] * i
-                if 0 <= endRow < 7 and 0 <= endColumn <= 7:
-                    endPiece = self.board[endRow][endColumn]
-                    if endPiece[0] == allyColor and endPiece[1] != "K":
-                        if possiblePin == ():  # 1st allied piece could be pinned
-                            possiblePin = (endRow, endColumn, d[0], d[1])
-                        else:
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        if (0 <= j <= 3 and type == "R") or \
-                                (4 <= j <= 7 and type == "B") or \
-                                (i == 1 and type == "P" and (
-                                        (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) or \
-                                (type == "Q") or (i == 1 and type == "K"):
-                            if possiblePin == ():
-                                inCheck = True
-                                checks.append((endRow, endColumn, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblePin)
-                                break
-                        else:
-                            break
-                else:
-                    break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endColumn = startColumn + m[1]
-            if 0 <= endRow <= 7 and 0 <= endColumn <= 7:
-                endPiece = self.board[endRow][endColumn]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":
-                    inCheck = True
-                    checks.append((endRow, endColumn, m[0], m[1]))
-        return inCheck, pins, checks
-
-
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
-
-
-class Move:
-    # maps keys to values
-    # key : value
-    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
-                   "5": 3, "6": 2, "7": 1, "8": 0}
-    rowsToRanks = {v: k for k, v in ranksToRows.items()}
-    filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
-                   "e": 4, "f": 5, "g": 6, "h": 7}
-    colsToFiles = {v: k for k, v in filesToCols.items()}
-
-    def __init__(self, startSQ, endSQ, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSQ[0]
-        self.startColumn = startSQ[1]
-        self.endRow = endSQ[0]
-        self.endColumn = endSQ[1]
-        self.pieceMoved = board[self.startRow][self.startColumn]
-        self.pieceCaptured = board[self.endRow][self.endColumn]
-        self.isPawnPromotion = (self.pieceMoved == 'wP' and self.endRow == 0) or (
-                self.pieceMoved == 'bP' and self.endRow == 7)
-        self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wP' if self.pieceMoved == 'bP' else 'bP'
-        # castle move
-        self.isCastleMove = isCastleMove
-        self.moveID = self.startRow * 1000 + self.startColumn * 100 + self.endRow * 10 + self.endColumn
-
-    '''
-    Overriding the equals method
-    '''
-
-    def __eq__(self, other):
-        if isinstance(other, Move):
-            return self.moveID == other.moveID
-        return False
-
-    def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startColumn) + self.getRankFile(self.endRow, self.endColumn)
-
-    def getRankFile(self, r, c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
+""" STORES INFORMATION """
+import random
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Bitboards use one bit per square, square index = row * 8 + column.
+# Bit 0 is a8 and bit 63 is h1, so the bit layout follows the rows of the board view.
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+# rays pointing towards higher square indices find their nearest blocker in the lowest set bit
+POSITIVE_DIRECTIONS = (False, False, True, True, False, False, True, True)
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ALL_SQUARES = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+LIGHT_SQUARES = sum(1 << square for square in range(64) if (square >> 3) + (square & 7) & 1 == 0)  # a8 is light
+FIFTY_MOVE_PLIES = 100  # plies without a capture or pawn move that draw the game
+PROMOTION_ROWS = {"w": 0xFF, "b": 0xFF << 56}  # row 0 for white pawns, row 7 for black pawns
+# which pseudo-legal moves GameState.getPseudoLegalMoves generates
+ALL_MOVES, CAPTURE_MOVES, QUIET_MOVES = 0, 1, 2
+
+# The engine passes moves around as ints: bits 0-5 start square, 6-11 end square, 12-13 promotion piece,
+# 14-15 kind of move, 16-19 piece moved and 20-23 piece captured (indexes into PIECE_CODES).
+# Move turns one into an object with named fields for the GUI.
+NORMAL_MOVE, ENPASSANT_MOVE, CASTLE_MOVE, PROMOTION_MOVE = 0, 1, 2, 3
+PROMOTION_PIECES = "QRBN"
+PIECE_CODES = ("--",) + PIECES
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECE_CODES)}
+MOVE_ID_MASK = (1 << 14) - 1  # start, end and promotion piece, enough to tell the moves of a position apart
+
+# castling rights are kept packed in 4 bits, the same way as CastleRights.index()
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_LETTERS = (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+# makeMove pushes one int per move for undoMove, with the state the move itself can't restore:
+# the castling rights in bits 0-3, the en passant square + 1 (0 for none) in bits 4-10
+# and the halfmove clock from bit 11 up. The Zobrist key goes onto its own stack, zobristKeyLog.
+UNDO_ENPASSANT_SHIFT = 4
+UNDO_CLOCK_SHIFT = 11
+
+
+def _buildLeaperAttacks(offsets):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        for dr, dc in offsets:
+            endRow, endColumn = row + dr, col + dc
+            if 0 <= endRow < 8 and 0 <= endColumn < 8:
+                mask |= 1 << (endRow * 8 + endColumn)
+        table.append(mask)
+    return table
+
+
+def _buildRays():
+    rays = []
+    for dr, dc in DIRECTIONS:
+        table = []
+        for square in range(64):
+            row, col = divmod(square, 8)
+            mask = 0
+            for i in range(1, 8):
+                endRow, endColumn = row + dr * i, col + dc * i
+                if not (0 <= endRow < 8 and 0 <= endColumn < 8):
+                    break
+                mask |= 1 << (endRow * 8 + endColumn)
+            table.append(mask)
+        rays.append(table)
+    return rays
+
+
+KNIGHT_ATTACKS = _buildLeaperAttacks(KNIGHT_OFFSETS)
+KING_ATTACKS = _buildLeaperAttacks(KING_OFFSETS)
+# squares attacked by a pawn of the given color standing on the square
+PAWN_ATTACKS = {"w": _buildLeaperAttacks(((-1, -1), (-1, 1))),
+                "b": _buildLeaperAttacks(((1, -1), (1, 1)))}
+RAYS = _buildRays()
+# the (row, column) of every square, shared so moves don't build new tuples for king and en passant squares
+SQUARE_COORDINATES = [divmod(square, 8) for square in range(64)]
+
+
+def _buildCastlingMasks():
+    """ The castling rights kept by a move from or to each square, a king or rook square loses its rights """
+    masks = [15] * 64
+    masks[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1
+    masks[56] = 15 & ~WHITE_QUEENSIDE  # a1
+    masks[63] = 15 & ~WHITE_KINGSIDE  # h1
+    masks[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8
+    masks[0] = 15 & ~BLACK_QUEENSIDE  # a8
+    masks[7] = 15 & ~BLACK_KINGSIDE  # h8
+    return masks
+
+
+CASTLING_MASKS = _buildCastlingMasks()
+# the pieces castling needs on their starting squares, a right without them is dropped by loadFEN
+CASTLING_PIECES = {60: "wK", 56: "wR", 63: "wR", 4: "bK", 0: "bR", 7: "bR"}
+
+# Zobrist keys, drawn from a fixed seed so position hashes are the same in every process and run
+_zobristRandom = random.Random(0x5A0B)
+ZOBRIST_PIECES = {piece: [_zobristRandom.getrandbits(64) for _ in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(16)]  # one per combination of rights
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)]  # one per file
+
+
+def nearestBlocker(blockers, direction):
+    """ Square index of the blocker closest to the ray origin """
+    if POSITIVE_DIRECTIONS[direction]:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
+def slidingAttacks(square, occupied, directions):
+    """ Squares reached from square along the given directions, stopping at (and including) the first blocker """
+    attacks = 0
+    for j in directions:
+        ray = RAYS[j][square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= RAYS[j][nearestBlocker(blockers, j)]
+        attacks |= ray
+    return attacks
+
+
+def iterSquares(bitboard):
+    """ Yield the square index of every set bit, lowest first """
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+class GameState():
+    def __init__(self, debugHash=False):
+        # board is 8x8 2D list, each element of the list has 2 characters
+        # The first character represents the color of the piece, 'b' or 'w'
+        # The second character represents the type of the piece
+        # The position itself lives in the bitboards below, the board list is only a view of it
+        board = [
+            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+            ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
+            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
+        self.pieceBitboards = {}  # one 64 bit set per piece, keyed like the board ("wP", "bK", ...)
+        self.colorOccupancy = {}  # all white / all black pieces
+        self.occupied = 0
+        self.squares = []  # piece on each square index, "--" when empty
+        self._boardView = None
+        self.zobristKey = 0  # 64 bit position hash, updated with every piece put on or taken off a square
+        self.debugHash = debugHash  # check the incremental hash against a full recompute after every move
+        # incremental evaluation, only kept once an evaluator hands over its tables (see setEvaluationTables)
+        self.materialValues = None  # piece -> value
+        self.positionValues = None  # piece -> value of the piece on each square index
+        self.materialTotals = {"w": 0, "b": 0}
+        self.positionTotals = {"w": 0, "b": 0}
+        self.loadBoard(board)
+        self.moveFunctions = {'P': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
+                              'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+        self.whiteToMove = True
+        self.moveLog = []
+        self.whiteKingLocation = (7, 4)
+        self.blackKingLocation = (0, 4)
+        self.checkMate = False
+        self.staleMate = False
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.legality = None  # pins and checks in the form isLegalMove uses, see computeLegality
+        self.enpassantPossible = ()  # coordinates for the square where an en passant capture is possible
+        self.castlingRights = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.halfmoveClock = 0  # plies since the last capture or pawn move
+        self.undoLog = []  # one packed record per move in moveLog, see UNDO_CLOCK_SHIFT
+        self.zobristKeyLog = []  # the key of the position before each move in moveLog, to find repetitions
+        self.fullmoveNumber = 1  # goes up after every black move
+        self.zobristKey = self.computeZobristKey()
+
+    @classmethod
+    def fromFEN(cls, fen):
+        """
+        New game state set up from a FEN string
+        """
+        gs = cls()
+        gs.loadFEN(fen)
+        return gs
+
+    @property
+    def board(self):
+        """
+        8x8 list view of the position, rebuilt from the squares on first access after a change.
+        It is read only, the bitboards are the real position.
+        """
+        if self._boardView is None:
+            squares = self.squares
+            self._boardView = [squares[r * 8:r * 8 + 8] for r in range(8)]
+        return self._boardView
+
+    @property
+    def currentCastlingRights(self):
+        """
+        The castling rights as a CastleRights. The position keeps them packed in castlingRights.
+        """
+        return CastleRights.fromIndex(self.castlingRights)
+
+    @currentCastlingRights.setter
+    def currentCastlingRights(self, rights):
+        self.castlingRights = rights.index()
+
+    def loadBoard(self, board):
+        """
+        Replace the pieces with the ones on an 8x8 board list
+        """
+        self.pieceBitboards = {piece: 0 for piece in PIECES}
+        self.colorOccupancy = {"w": 0, "b": 0}
+        self.occupied = 0
+        self.squares = ["--"] * 64
+        self.zobristKey = 0
+        self.materialTotals = {"w": 0, "b": 0}
+        self.positionTotals = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] != "--":
+                    self.putPiece(r * 8 + c, board[r][c])
+                    if board[r][c] == "wK":
+                        self.whiteKingLocation = (r, c)
+                    elif board[r][c] == "bK":
+                        self.blackKingLocation = (r, c)
+        self._boardView = None
+
+    def loadFEN(self, fen):
+        """
+        Replace the whole position with the one in a FEN string and forget the move history.
+        The two move counter fields may be left out (as in EPD), they default to 0 and 1.
+        Raises ValueError for a malformed string, before anything is changed.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: %r" % fen)
+        rows = fields[0].split("/")
+        board = []
+        for rank in rows:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.upper() in "PNBRQK":
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+                else:
+                    raise ValueError("bad piece %r in FEN: %r" % (char, fen))
+            if len(row) != 8:
+                raise ValueError("rank %r does not have 8 squares in FEN: %r" % (rank, fen))
+            board.append(row)
+        if len(board) != 8 or fields[1] not in ("w", "b"):
+            raise ValueError("bad board or side to move in FEN: %r" % fen)
+        if any(piece[1] == "P" for piece in board[0] + board[7]):
+            raise ValueError("pawn on the first or last rank in FEN: %r" % fen)
+        if fields[2] != "-" and (not set(fields[2]) <= set("KQkq") or len(set(fields[2])) != len(fields[2])):
+            raise ValueError("bad castling rights in FEN: %r" % fen)
+        # the square behind a pawn that has just moved two squares, so on the 6th rank when white is to move
+        if fields[3] != "-" and (len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols
+                                 or fields[3][1] != ("6" if fields[1] == "w" else "3")):
+            raise ValueError("bad en passant square in FEN: %r" % fen)
+        halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.loadBoard(board)
+        self.whiteToMove = fields[1] == "w"
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.legality = None
+        if fields[3] == "-":
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        self.castlingRights = 0
+        for letter, right in CASTLING_LETTERS:
+            if letter in fields[2]:
+                self.castlingRights |= right
+        for square, piece in CASTLING_PIECES.items():
+            if self.squares[square] != piece:
+                self.castlingRights &= CASTLING_MASKS[square]
+        self.halfmoveClock = halfmoveClock
+        self.undoLog = []
+        self.zobristKeyLog = []
+        self.fullmoveNumber = fullmoveNumber
+        self.zobristKey = self.computeZobristKey()
+
+    def toFEN(self):
+        """
+        The position as a FEN string
+        """
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.squares[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        castling = "".join(letter for letter, right in CASTLING_LETTERS if self.castlingRights & right)
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    def getSAN(self, move, validMoves=None):
+        """
+        The legal move (packed or a Move) in standard algebraic notation, e.g. Nbd2, exd5, e8=Q+ or O-O#
+        """
+        if not isinstance(move, int):
+            move = move.code
+        if validMoves is None:
+            validMoves = self.getLegalMoves()
+        else:
+            validMoves = [other if isinstance(other, int) else other.code for other in validMoves]
+        startSquare, endSquare, kind = move & 63, move >> 6 & 63, move >> 14 & 3
+        piece = PIECE_CODES[move >> 16 & 15][1]
+        target = Move.colsToFiles[endSquare & 7] + Move.rowsToRanks[endSquare >> 3]
+        if kind == CASTLE_MOVE:
+            san = "O-O" if endSquare > startSquare else "O-O-O"
+        elif piece == "P":
+            san = Move.colsToFiles[startSquare & 7] + "x" + target if move >> 20 else target
+            if kind == PROMOTION_MOVE:
+                san += "=" + PROMOTION_PIECES[move >> 12 & 3]
+        else:
+            # other pieces of the same type that can reach the same square
+            rivals = [other & 63 for other in validMoves if other >> 6 & 63 == endSquare
+                      and other >> 16 & 15 == move >> 16 & 15 and other & 63 != startSquare]
+            disambiguation = ""
+            if rivals:
+                if all(rival & 7 != startSquare & 7 for rival in rivals):
+                    disambiguation = Move.colsToFiles[startSquare & 7]
+                elif all(rival >> 3 != startSquare >> 3 for rival in rivals):
+                    disambiguation = Move.rowsToRanks[startSquare >> 3]
+                else:
+                    disambiguation = Move.colsToFiles[startSquare & 7] + Move.rowsToRanks[startSquare >> 3]
+            san = piece + disambiguation + ("x" if move >> 20 else "") + target
+        self.makeMove(move)
+        if self.checkForPinsAndChecks()[0]:
+            san += "#" if len(self.getLegalMoves()) == 0 else "+"
+        self.undoMove()
+        return san
+
+    def putPiece(self, square, piece):
+        bit = 1 << square
+        self.pieceBitboards[piece] |= bit
+        self.colorOccupancy[piece[0]] |= bit
+        self.occupied |= bit
+        self.squares[square] = piece
+        self.zobristKey ^= ZOBRIST_PIECES[piece][square]
+        if self.positionValues is not None:
+            self.materialTotals[piece[0]] += self.materialValues[piece]
+            self.positionTotals[piece[0]] += self.positionValues[piece][square]
+        self._boardView = None
+
+    def removePiece(self, square):
+        piece = self.squares[square]
+        mask = ~(1 << square)
+        self.pieceBitboards[piece] &= mask
+        self.colorOccupancy[piece[0]] &= mask
+        self.occupied &= mask
+        self.squares[square] = "--"
+        self.zobristKey ^= ZOBRIST_PIECES[piece][square]
+        if self.positionValues is not None:
+            self.materialTotals[piece[0]] -= self.materialValues[piece]
+            self.positionTotals[piece[0]] -= self.positionValues[piece][square]
+        self._boardView = None
+        return piece
+
+    def setEvaluationTables(self, materialValues, positionValues):
+        """
+        Keep material and piece-square totals for each side up to date from now on.
+        materialValues maps a piece to its value, positionValues maps it to a list of 64 square bonuses.
+        Every piece put on or taken off a square adjusts the totals, so promotions, en passant and the
+        castling rook are all covered by makeMove/undoMove.
+        """
+        self.materialValues = materialValues
+        self.positionValues = positionValues
+        self.materialTotals = {"w": 0, "b": 0}
+        self.positionTotals = {"w": 0, "b": 0}
+        for square in range(64):
+            piece = self.squares[square]
+            if piece != "--":
+                self.materialTotals[piece[0]] += materialValues[piece]
+                self.positionTotals[piece[0]] += positionValues[piece][square]
+
+    def computeZobristKey(self):
+        """
+        Hash the whole position from scratch. makeMove/undoMove keep zobristKey up to date with XORs instead.
+        """
+        key = 0
+        for square in range(64):
+            if self.squares[square] != "--":
+                key ^= ZOBRIST_PIECES[self.squares[square]][square]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    def verifyZobristKey(self):
+        if self.zobristKey != self.computeZobristKey():
+            raise AssertionError("incremental Zobrist key %016x does not match recomputed key %016x"
+                                 % (self.zobristKey, self.computeZobristKey()))
+
+    def hashEnpassantAndCastling(self):
+        """
+        XOR the en passant and castling keys of the current state in or out of the hash
+        """
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.zobristKey ^= ZOBRIST_CASTLING[self.castlingRights]
+
+    def makeMove(self, move):
+        """
+        Make a move, given as a packed int or as a Move. The move log keeps the packed int,
+        the undo log what else undoMove needs to go back.
+        """
+        if not isinstance(move, int):
+            move = move.code
+        startSquare = move & 63
+        endSquare = move >> 6 & 63
+        kind = move >> 14 & 3
+        pieceMoved = PIECE_CODES[move >> 16 & 15]
+        pieceCaptured = PIECE_CODES[move >> 20]
+        enpassant = self.enpassantPossible
+        self.undoLog.append(self.castlingRights
+                            | (enpassant[0] * 8 + enpassant[1] + 1 if enpassant else 0) << UNDO_ENPASSANT_SHIFT
+                            | self.halfmoveClock << UNDO_CLOCK_SHIFT)
+        self.zobristKeyLog.append(self.zobristKey)
+        self.removePiece(startSquare)
+        if pieceCaptured != "--" and kind != ENPASSANT_MOVE:
+            self.removePiece(endSquare)
+        self.moveLog.append(move)
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+        self.hashEnpassantAndCastling()  # take the old en passant square and rights out of the hash
+        # update king location
+        if pieceMoved == 'wK':
+            self.whiteKingLocation = SQUARE_COORDINATES[endSquare]
+        elif pieceMoved == 'bK':
+            self.blackKingLocation = SQUARE_COORDINATES[endSquare]
+
+        # pawn promotion
+        if kind == PROMOTION_MOVE:
+            self.putPiece(endSquare, pieceMoved[0] + PROMOTION_PIECES[move >> 12 & 3])
+        else:
+            self.putPiece(endSquare, pieceMoved)
+
+        # en passant move
+        if kind == ENPASSANT_MOVE:
+            self.removePiece((startSquare & ~7) | (endSquare & 7))
+
+        # update en passant variable
+        if pieceMoved[1] == 'P' and abs(startSquare - endSquare) == 16:  # only on 2 sq pawn advances
+            self.enpassantPossible = SQUARE_COORDINATES[(startSquare + endSquare) >> 1]
+        else:
+            self.enpassantPossible = ()
+
+        # castle move
+        if kind == CASTLE_MOVE:
+            if endSquare - startSquare == 2:  # kingside
+                self.putPiece(endSquare - 1, self.removePiece(endSquare + 1))  # move rook, erase old rook
+            else:  # queenside
+                self.putPiece(endSquare + 1, self.removePiece(endSquare - 2))
+
+        # update castling rights - whenever a king or rook moves or a rook is captured
+        self.castlingRights &= CASTLING_MASKS[startSquare] & CASTLING_MASKS[endSquare]
+
+        # move counters
+        if pieceMoved[1] == 'P' or pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if self.whiteToMove:  # black just moved
+            self.fullmoveNumber += 1
+        self.hashEnpassantAndCastling()
+        if self.debugHash:
+            self.verifyZobristKey()
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog.pop()
+            record = self.undoLog.pop()
+            startSquare = move & 63
+            endSquare = move >> 6 & 63
+            kind = move >> 14 & 3
+            pieceMoved = PIECE_CODES[move >> 16 & 15]
+            pieceCaptured = PIECE_CODES[move >> 20]
+            self.removePiece(endSquare)
+            self.putPiece(startSquare, pieceMoved)
+            self.whiteToMove = not self.whiteToMove
+            # update the king location
+            if pieceMoved == "wK":
+                self.whiteKingLocation = SQUARE_COORDINATES[startSquare]
+            elif pieceMoved == "bK":
+                self.blackKingLocation = SQUARE_COORDINATES[startSquare]
+            # undo en passant
+            if kind == ENPASSANT_MOVE:
+                # landing square stays blank
+                self.putPiece((startSquare & ~7) | (endSquare & 7), pieceCaptured)
+            elif pieceCaptured != "--":
+                self.putPiece(endSquare, pieceCaptured)
+
+            # undo castle move
+            if kind == CASTLE_MOVE:
+                if endSquare - startSquare == 2:
+                    self.putPiece(endSquare + 1, self.removePiece(endSquare - 1))
+                else:
+                    self.putPiece(endSquare - 2, self.removePiece(endSquare + 1))
+
+            # undo the en passant square, castling rights, clock and hash from the undo record
+            enpassant = record >> UNDO_ENPASSANT_SHIFT & 127
+            self.enpassantPossible = SQUARE_COORDINATES[enpassant - 1] if enpassant else ()
+            self.castlingRights = record & 15
+            self.halfmoveClock = record >> UNDO_CLOCK_SHIFT
+            self.zobristKey = self.zobristKeyLog.pop()  # replaces the piece updates made on the way back
+            if not self.whiteToMove:  # undoing a black move
+                self.fullmoveNumber -= 1
+            self.checkMate = False
+            self.staleMate = False
+            if self.debugHash:
+                self.verifyZobristKey()
+
+    def isRepetition(self, count=1):
+        """
+        Whether the position, with the same side to move and rights, was reached count times before in moveLog.
+        A capture, pawn move or change of rights can't be undone, so only the positions since the last capture
+        or pawn move (halfmoveClock plies) and with the same side to move are looked at.
+        """
+        keys = self.zobristKeyLog
+        key = self.zobristKey
+        found = 0
+        for i in range(len(keys) - 2, max(len(keys) - self.halfmoveClock, 0) - 1, -2):
+            if keys[i] == key:
+                found += 1
+                if found == count:
+                    return True
+        return False
+
+    def isInsufficientMaterial(self):
+        """
+        Whether neither side can ever mate: bare kings, a single knight or bishop,
+        or only bishops that all stand on squares of one color
+        """
+        bitboards = self.pieceBitboards
+        if bitboards["wP"] | bitboards["bP"] | bitboards["wR"] | bitboards["bR"] | bitboards["wQ"] | bitboards["bQ"]:
+            return False
+        knights = bitboards["wN"] | bitboards["bN"]
+        bishops = bitboards["wB"] | bitboards["bB"]
+        minors = knights | bishops
+        if minors & (minors - 1) == 0:  # at most one minor piece
+            return True
+        return not knights and (not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES)
+
+    def getDrawReason(self):
+        """
+        Why the game is drawn by rule ("threefold repetition", "fifty move rule" or "insufficient material"),
+        or None. Stalemate is found by getLegalMoves, and a mate on the last move before the fifty move rule
+        still counts, so check for mate first.
+        """
+        if self.halfmoveClock >= FIFTY_MOVE_PLIES:
+            return "fifty move rule"
+        if self.isRepetition(2):
+            return "threefold repetition"
+        if self.isInsufficientMaterial():
+            return "insufficient material"
+        return None
+
+    def getValidMoves(self):
+        """
+        The legal moves as Move objects, for the GUI. The engine itself works on the packed moves of getLegalMoves.
+        """
+        return [Move.fromCode(move) for move in self.getLegalMoves()]
+
+    def getLegalMoves(self):
+        """
+        The legal moves as packed ints. Also sets checkMate and staleMate.
+        """
+        legality = self.computeLegality()
+        moves = [move for move in self.getPseudoLegalMoves() if self.isLegalMove(move, legality)]
+
+        if len(moves) == 0:
+            if self.inCheck:
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
+
+        return moves
+
+    def computeLegality(self):
+        """
+        Find the pins and checks of the side to move and return what isLegalMove needs from them:
+        [in check, squares a non-king move has to end on, pinned square -> pin direction, king square,
+        squares the enemy attacks]. The attacked squares are None until a king move is checked, which fills
+        them in, so they are worked out at most once per position and only in positions that need them.
+        The result stays valid for this position even after other positions have been searched from it.
+        """
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        kingRow, kingColumn = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if not self.inCheck:
+            blockSquares = ALL_SQUARES
+        elif len(self.checks) == 1:  # only 1 check, block the check or move the king
+            # to block the check you must put a piece into one of the squares between the enemy piece and your king
+            checkRow, checkColumn, dr, dc = self.checks[0]
+            blockSquares = 0
+            for i in range(1, 8):
+                # for a knight the check direction is its jump, so the first step already reaches it
+                square = (kingRow + dr * i) * 8 + kingColumn + dc * i
+                blockSquares |= 1 << square
+                if square == checkRow * 8 + checkColumn:  # once you get to piece and check
+                    break
+        else:  # double check, king has to move
+            blockSquares = 0
+        pinDirections = {}
+        for pin in self.pins:
+            pinDirections[pin[0] * 8 + pin[1]] = (pin[2], pin[3])
+        self.legality = [self.inCheck, blockSquares, pinDirections, kingRow * 8 + kingColumn, None]
+        return self.legality
+
+    def isLegalMove(self, move, legality=None):
+        """
+        Check a pseudo-legal move against the pins and checks from computeLegality (the last call when not given)
+        """
+        if legality is None:
+            legality = self.legality
+        inCheck, blockSquares, pinDirections, kingSquare, enemyAttacks = legality
+        startSquare = move & 63
+        endSquare = move >> 6 & 63
+        kind = move >> 14 & 3
+        if startSquare == kingSquare:
+            if enemyAttacks is None:
+                # seen with the king off the board, so it can't step back along the line of a checking slider
+                enemyAttacks = legality[4] = self.getAttackMap("b" if self.whiteToMove else "w",
+                                                               self.occupied & ~(1 << kingSquare))
+            if kind == CASTLE_MOVE:
+                if inCheck:
+                    return False  # can't castle while in check
+                passedSquare = (startSquare + endSquare) // 2
+                return not enemyAttacks & (1 << passedSquare | 1 << endSquare)
+            return not enemyAttacks & (1 << endSquare)
+        if not blockSquares & (1 << endSquare):
+            # an en passant capture takes the checking pawn without landing on its square
+            if not (kind == ENPASSANT_MOVE and blockSquares & (1 << ((startSquare & ~7) | (endSquare & 7)))):
+                return False  # move doesn't block or capture piece
+        direction = pinDirections.get(startSquare)
+        # a pinned piece may only move along the line between its king and the pinning piece
+        if direction is not None and ((endSquare >> 3) - (startSquare >> 3)) * direction[1] != \
+                ((endSquare & 7) - (startSquare & 7)) * direction[0]:
+            return False
+        if kind == ENPASSANT_MOVE:
+            return not self.enpassantExposesKing(startSquare, (startSquare & ~7) | (endSquare & 7), endSquare)
+        return True
+
+    def inCheck(self):
+        """
+        Determine if a current player is in check
+        """
+        if self.whiteToMove:
+            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
+        else:
+            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+
+    def squareUnderAttack(self, r, c):
+        """ Determine if enemy can attack the square row and column """
+        return bool(self.getAttackMap("b" if self.whiteToMove else "w") & (1 << (r * 8 + c)))
+
+    def getAttackMap(self, color, occupied=None):
+        """
+        The squares the pieces of color attack, as a bitboard.
+        Squares of either color count, so a piece's defenders show up as attacks on it.
+        occupied can leave out pieces the attacks go through, the default is the whole board.
+        """
+        if occupied is None:
+            occupied = self.occupied
+        bitboards = self.pieceBitboards
+        pawns = bitboards[color + "P"]
+        if color == "w":  # white pawns capture towards row 0
+            left, right = (pawns & ~FILE_A) >> 9, (pawns & ~FILE_H) >> 7
+        else:
+            left, right = (pawns & ~FILE_A) << 7 & ALL_SQUARES, (pawns & ~FILE_H) << 9 & ALL_SQUARES
+        attacked = left | right
+        for square in iterSquares(bitboards[color + "N"]):
+            attacked |= KNIGHT_ATTACKS[square]
+        for piece, directions in (("B", BISHOP_DIRECTIONS), ("R", ROOK_DIRECTIONS), ("Q", QUEEN_DIRECTIONS)):
+            for square in iterSquares(bitboards[color + piece]):
+                attacked |= slidingAttacks(square, occupied, directions)
+        for square in iterSquares(bitboards[color + "K"]):
+            attacked |= KING_ATTACKS[square]
+        return attacked
+
+    def getPseudoLegalMoves(self, kind=ALL_MOVES, moves=None):
+        """
+        Packed moves of the side to move that follow the piece rules but may leave the king in check,
+        see isLegalMove. kind picks CAPTURE_MOVES (captures, en passant and promotions), QUIET_MOVES
+        (the rest, castling included) or ALL_MOVES. The moves are appended to moves when a list to reuse is given.
+        """
+        allyColor, enemyColor = ("w", "b") if self.whiteToMove else ("b", "w")
+        if moves is None:
+            moves = []
+        if kind == ALL_MOVES:
+            self.getAllPossibleMoves(moves)
+        else:
+            if kind == CAPTURE_MOVES:
+                targets = self.colorOccupancy[enemyColor]
+                pawnTargets = targets | PROMOTION_ROWS[allyColor]
+                if self.enpassantPossible != ():
+                    pawnTargets |= 1 << (self.enpassantPossible[0] * 8 + self.enpassantPossible[1])
+            else:
+                targets = ~self.occupied & ALL_SQUARES
+                pawnTargets = targets & ~PROMOTION_ROWS[allyColor]
+                if self.enpassantPossible != ():  # no push ends there, so this only drops the capture stage's move
+                    pawnTargets &= ~(1 << (self.enpassantPossible[0] * 8 + self.enpassantPossible[1]))
+            for piece in "PNBRQK":
+                moveFunction = self.moveFunctions[piece]
+                for square in iterSquares(self.pieceBitboards[allyColor + piece]):
+                    moveFunction(square >> 3, square & 7, moves, pawnTargets if piece == "P" else targets)
+        if kind != CAPTURE_MOVES:
+            kingRow, kingColumn = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+            self.getCastleMoves(kingRow, kingColumn, moves)
+        return moves
+
+    def getPseudoLegalMove(self, moveID):
+        """
+        The packed pseudo-legal move with this moveID (move & MOVE_ID_MASK), or None if the position has no such move
+        """
+        startRow, startColumn = (moveID & 63) >> 3, moveID & 7
+        piece = self.squares[moveID & 63]
+        if piece == "--" or (piece[0] == "w") != self.whiteToMove:
+            return None
+        moves = []
+        self.moveFunctions[piece[1]](startRow, startColumn, moves)
+        if piece[1] == "K":
+            self.getCastleMoves(startRow, startColumn, moves)
+        for move in moves:
+            if move & MOVE_ID_MASK == moveID:
+                return move
+        return None
+
+    def getAllPossibleMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        allyColor = "w" if self.whiteToMove else "b"
+        for piece in "PNBRQK":
+            moveFunction = self.moveFunctions[piece]
+            for square in iterSquares(self.pieceBitboards[allyColor + piece]):
+                moveFunction(square >> 3, square & 7, moves)
+        return moves
+
+    def addMoves(self, startSquare, targets, moves):
+        """
+        Add a move from startSquare to every square in the targets bitboard
+        """
+        squares = self.squares
+        start = startSquare | PIECE_INDEX[squares[startSquare]] << 16
+        for endSquare in iterSquares(targets):
+            moves.append(start | endSquare << 6 | PIECE_INDEX[squares[endSquare]] << 20)
+
+    def addPromotions(self, startSquare, targets, moves):
+        """
+        Add one move per promotion piece from startSquare to every square in the targets bitboard
+        """
+        start = startSquare | PROMOTION_MOVE << 14 | PIECE_INDEX[self.squares[startSquare]] << 16
+        for endSquare in iterSquares(targets):
+            move = start | endSquare << 6 | PIECE_INDEX[self.squares[endSquare]] << 20
+            for promotionPiece in range(len(PROMOTION_PIECES)):
+                moves.append(move | promotionPiece << 12)
+
+    # every piece generator only adds moves ending on a square in targetMask
+    def getPawnMoves(self, r, c, moves, targetMask=ALL_SQUARES):
+        startSquare = r * 8 + c
+        if self.whiteToMove:
+            allyColor, enemyColor, forward, startRow = "w", "b", -8, 6
+        else:  # black pawn moves
+            allyColor, enemyColor, forward, startRow = "b", "w", 8, 1
+        targets = 0
+        if self.squares[startSquare + forward] == "--":
+            targets |= 1 << (startSquare + forward)
+            if r == startRow and self.squares[startSquare + 2 * forward] == "--":
+                targets |= 1 << (startSquare + 2 * forward)
+        attacks = PAWN_ATTACKS[allyColor][startSquare]
+        targets = (targets | (attacks & self.colorOccupancy[enemyColor])) & targetMask
+        promotions = targets & PROMOTION_ROWS[allyColor]
+        self.addMoves(startSquare, targets ^ promotions, moves)
+        if promotions:
+            self.addPromotions(startSquare, promotions, moves)
+        if self.enpassantPossible != ():
+            enpassantRow, enpassantColumn = self.enpassantPossible
+            endSquare = enpassantRow * 8 + enpassantColumn
+            if attacks & targetMask & (1 << endSquare):
+                moves.append(startSquare | endSquare << 6 | ENPASSANT_MOVE << 14 | PIECE_INDEX[allyColor + "P"] << 16
+                             | PIECE_INDEX[enemyColor + "P"] << 20)
+
+    def enpassantExposesKing(self, startSquare, capturedSquare, endSquare):
+        """
+        En passant takes two pawns off a line at once, which the pin checks cannot see, so look for
+        sliders hitting the king once both pawns are gone
+        """
+        allyColor, enemyColor = ("w", "b") if self.whiteToMove else ("b", "w")
+        kingLocation = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSquare = kingLocation[0] * 8 + kingLocation[1]
+        occupied = (self.occupied & ~(1 << startSquare) & ~(1 << capturedSquare)) | (1 << endSquare)
+        bitboards = self.pieceBitboards
+        enemyQueens = bitboards[enemyColor + "Q"]
+        return bool(slidingAttacks(kingSquare, occupied, ROOK_DIRECTIONS) & (bitboards[enemyColor + "R"] | enemyQueens)
+                    or slidingAttacks(kingSquare, occupied, BISHOP_DIRECTIONS)
+                    & (bitboards[enemyColor + "B"] | enemyQueens))
+
+    def getRookMoves(self, r, c, moves, targetMask=ALL_SQUARES):
+        allyColor = "w" if self.whiteToMove else "b"
+        startSquare = r * 8 + c
+        targets = slidingAttacks(startSquare, self.occupied, ROOK_DIRECTIONS)
+        self.addMoves(startSquare, targets & ~self.colorOccupancy[allyColor] & targetMask, moves)
+
+    def getBishopMoves(self, r, c, moves, targetMask=ALL_SQUARES):
+        allyColor = "w" if self.whiteToMove else "b"
+        startSquare = r * 8 + c
+        targets = slidingAttacks(startSquare, self.occupied, BISHOP_DIRECTIONS)
+        self.addMoves(startSquare, targets & ~self.colorOccupancy[allyColor] & targetMask, moves)
+
+    def getKnightMoves(self, r, c, moves, targetMask=ALL_SQUARES):
+        allyColor = "w" if self.whiteToMove else "b"
+        startSquare = r * 8 + c
+        self.addMoves(startSquare, KNIGHT_ATTACKS[startSquare] & ~self.colorOccupancy[allyColor] & targetMask, moves)
+
+    def getKingMoves(self, row, col, moves, targetMask=ALL_SQUARES):
+        """
+        Get all the king moves for the king located at row col and add the moves to the list.
+        Squares the king would be attacked on are left to isLegalMove.
+        """
+        allyColor = "w" if self.whiteToMove else "b"
+        startSquare = row * 8 + col
+        self.addMoves(startSquare, KING_ATTACKS[startSquare] & ~self.colorOccupancy[allyColor] & targetMask, moves)
+
+        '''
+        Generate all valid castle moves for the king at (r, c) and then add them to the list of moves
+        '''
+
+    def getCastleMoves(self, r, c, moves):
+        # whether the king is in check or passes an attacked square is left to isLegalMove
+        rights = self.castlingRights if self.whiteToMove else self.castlingRights >> 2  # black's in white's bits
+        if rights & WHITE_KINGSIDE:
+            self.getKingsideCastleMoves(r, c, moves)
+        if rights & WHITE_QUEENSIDE:
+            self.getQueensideCastleMoves(r, c, moves)
+
+    def getKingsideCastleMoves(self, r, c, moves):
+        square = r * 8 + c
+        if self.squares[square + 1] == '--' and self.squares[square + 2] == '--':
+            moves.append(square | (square + 2) << 6 | CASTLE_MOVE << 14 | PIECE_INDEX[self.squares[square]] << 16)
+
+    def getQueensideCastleMoves(self, r, c, moves):
+        square = r * 8 + c
+        if self.squares[square - 1] == '--' and self.squares[square - 2] == '--' and self.squares[square - 3] == '--':
+            moves.append(square | (square - 2) << 6 | CASTLE_MOVE << 14 | PIECE_INDEX[self.squares[square]] << 16)
+
+    def getQueenMoves(self, r, c, moves, targetMask=ALL_SQUARES):
+        self.getRookMoves(r, c, moves, targetMask)
+        self.getBishopMoves(r, c, moves, targetMask)
+
+    def checkForPinsAndChecks(self):
+        pins = []
+        checks = []
+        inCheck = False
+        if self.whiteToMove:
+            enemyColor = "b"
+            allyColor = "w"
+            startRow = self.whiteKingLocation[0]
+            startColumn = self.whiteKingLocation[1]
+        else:
+            enemyColor = "w"
+            allyColor = "b"
+            startRow = self.blackKingLocation[0]
+            startColumn = self.blackKingLocation[1]
+        kingSquare = startRow * 8 + startColumn
+        bitboards = self.pieceBitboards
+        # our own king does not block, so a king stepping back along a checking line is still in check
+        occupied = self.occupied & ~bitboards[allyColor + "K"]
+        allies = self.colorOccupancy[allyColor] & occupied
+        enemyQueens = bitboards[enemyColor + "Q"]
+        for j in range(len(DIRECTIONS)):
+            d = DIRECTIONS[j]
+            blockers = RAYS[j][kingSquare] & occupied
+            if not blockers:
+                continue
+            sliders = enemyQueens | (bitboards[enemyColor + "R"] if j <= 3 else bitboards[enemyColor + "B"])
+            first = nearestBlocker(blockers, j)
+            if (1 << first) & allies:  # 1st allied piece could be pinned
+                beyond = RAYS[j][first] & occupied
+                if beyond and (1 << nearestBlocker(beyond, j)) & sliders:
+                    pins.append((first >> 3, first & 7, d[0], d[1]))
+            elif (1 << first) & sliders:
+                inCheck = True
+                checks.append((first >> 3, first & 7, d[0], d[1]))
+        # pawns, knights and the enemy king can only check from next to (or a knight jump from) the king
+        for attacks, piece in ((PAWN_ATTACKS[allyColor][kingSquare], "P"), (KNIGHT_ATTACKS[kingSquare], "N"),
+                               (KING_ATTACKS[kingSquare], "K")):
+            for square in iterSquares(attacks & bitboards[enemyColor + piece]):
+                endRow, endColumn = square >> 3, square & 7
+                inCheck = True
+                checks.append((endRow, endColumn, endRow - startRow, endColumn - startColumn))
+        return inCheck, pins, checks
+
+
+class CastleRights:
+    def __init__(self, wks, bks, wqs, bqs):
+        self.wks = wks
+        self.bks = bks
+        self.wqs = wqs
+        self.bqs = bqs
+
+    def copy(self):
+        return CastleRights(self.wks, self.bks, self.wqs, self.bqs)
+
+    @classmethod
+    def fromIndex(cls, index):
+        """ The rights packed by index() """
+        return cls(bool(index & WHITE_KINGSIDE), bool(index & BLACK_KINGSIDE), bool(index & WHITE_QUEENSIDE),
+                   bool(index & BLACK_QUEENSIDE))
+
+    def index(self):
+        """ The four rights packed into a number from 0 to 15 """
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+
+class Move:
+    """
+    A move with named fields, for the GUI and notation. The engine passes moves around as packed ints
+    (see PIECE_CODES at the top), code holds this move packed and fromCode unpacks one.
+    """
+    __slots__ = ("startRow", "startColumn", "endRow", "endColumn", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "isEnpassantMove", "isCastleMove", "promotionPiece", "moveID", "code")
+
+    # maps keys to values
+    # key : value
+    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
+                   "5": 3, "6": 2, "7": 1, "8": 0}
+    rowsToRanks = {v: k for k, v in ranksToRows.items()}
+    filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
+                   "e": 4, "f": 5, "g": 6, "h": 7}
+    colsToFiles = {v: k for k, v in filesToCols.items()}
+
+    promotionCodes = {"Q": 0, "R": 1, "B": 2, "N": 3}
+
+    def __init__(self, startSQ, endSQ, board, isEnpassantMove=False, isCastleMove=False,
+                 pieceMoved=None, pieceCaptured=None, promotionPiece="Q"):
+        self.startRow = startSQ[0]
+        self.startColumn = startSQ[1]
+        self.endRow = endSQ[0]
+        self.endColumn = endSQ[1]
+        # the move generator passes the pieces directly so it never has to build the board view
+        self.pieceMoved = board[self.startRow][self.startColumn] if pieceMoved is None else pieceMoved
+        self.pieceCaptured = board[self.endRow][self.endColumn] if pieceCaptured is None else pieceCaptured
+        self.isPawnPromotion = (self.pieceMoved == 'wP' and self.endRow == 0) or (
+                self.pieceMoved == 'bP' and self.endRow == 7)
+        self.isEnpassantMove = isEnpassantMove
+        if self.isEnpassantMove:
+            self.pieceCaptured = 'wP' if self.pieceMoved == 'bP' else 'bP'
+        # castle move
+        self.isCastleMove = isCastleMove
+        self.promotionPiece = promotionPiece  # piece type the pawn becomes, queen unless asked otherwise
+        if self.isEnpassantMove:
+            kind = ENPASSANT_MOVE
+        elif self.isCastleMove:
+            kind = CASTLE_MOVE
+        elif self.isPawnPromotion:
+            kind = PROMOTION_MOVE
+        else:
+            kind = NORMAL_MOVE
+        self.code = (self.startRow * 8 + self.startColumn) | (self.endRow * 8 + self.endColumn) << 6 \
+            | (self.promotionCodes[promotionPiece] if self.isPawnPromotion else 0) << 12 | kind << 14 \
+            | PIECE_INDEX[self.pieceMoved] << 16 | PIECE_INDEX[self.pieceCaptured] << 20
+        self.moveID = self.code & MOVE_ID_MASK
+
+    @classmethod
+    def fromCode(cls, code):
+        kind = code >> 14 & 3
+        return cls(divmod(code & 63, 8), divmod(code >> 6 & 63, 8), None, isEnpassantMove=kind == ENPASSANT_MOVE,
+                   isCastleMove=kind == CASTLE_MOVE, pieceMoved=PIECE_CODES[code >> 16 & 15],
+                   pieceCaptured=PIECE_CODES[code >> 20], promotionPiece=PROMOTION_PIECES[code >> 12 & 3])
+
+    '''
+    Overriding the equals method
+    '''
+
+    def __eq__(self, other):
+        if isinstance(other, Move):
+            return self.moveID == other.moveID
+        return False
+
+    def getChessNotation(self):
+        notation = self.getRankFile(self.startRow, self.startColumn) + self.getRankFile(self.endRow, self.endColumn)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
+
+    def getRankFile(self, r, c):
+        return self.colsToFiles[c] + self.rowsToRanks[r]
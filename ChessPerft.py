@@ -0,0 +1,174 @@
+"""
+Perft and move generator benchmarks.
+
+Perft counts the leaf nodes of the tree of legal moves to a fixed depth. The counts for the
+standard test positions below are well known, so any difference points at a bug in
+GameState.getLegalMoves, makeMove or undoMove.
+
+    python ChessPerft.py perft 4                  count from the start position
+    python ChessPerft.py perft 3 --fen "..." --divide
+    python ChessPerft.py suite --depth 3          check every test position
+    python ChessPerft.py bench --record bench_history.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+
+import ChessEngine
+
+# (name, FEN, leaf counts for depth 1, 2, 3, ...)
+TEST_POSITIONS = [
+    ("start", ChessEngine.START_FEN,
+     (20, 400, 8902, 197281, 4865609)),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     (48, 2039, 97862, 4085603)),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     (14, 191, 2812, 43238, 674624)),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     (6, 264, 9467, 422333)),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     (44, 1486, 62379, 2103487)),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     (46, 2079, 89890, 3894594)),
+]
+
+
+def perft(gs, depth):
+    """
+    Number of leaf nodes of the legal move tree depth plies deep
+    """
+    if depth == 0:
+        return 1
+    moves = gs.getLegalMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """
+    Perft split by root move, as a list of (move notation, leaf nodes). Comparing this with another
+    engine's divide output narrows a wrong total down to a single move.
+    """
+    results = []
+    for move in gs.getLegalMoves():
+        gs.makeMove(move)
+        results.append((ChessEngine.Move.fromCode(move).getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return sorted(results)
+
+
+def runPerft(gs, depth, showDivide=False, out=sys.stdout):
+    start = time.perf_counter()
+    if showDivide:
+        results = divide(gs, depth)
+        for notation, nodes in results:
+            print("%s: %d" % (notation, nodes), file=out)
+        nodes = sum(count for _, count in results)
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    print("depth %d: %d nodes in %.2fs (%.0f nodes/s)" % (depth, nodes, elapsed, nodes / max(elapsed, 1e-9)),
+          file=out)
+    return nodes
+
+
+def runSuite(maxDepth=3, out=sys.stdout):
+    """
+    Perft every test position up to maxDepth. Returns the number of wrong counts.
+    """
+    failures = 0
+    totalNodes = 0
+    start = time.perf_counter()
+    for name, fen, expectedCounts in TEST_POSITIONS:
+        gs = ChessEngine.GameState.fromFEN(fen)
+        for depth in range(1, min(maxDepth, len(expectedCounts)) + 1):
+            nodes = perft(gs, depth)
+            totalNodes += nodes
+            status = "ok" if nodes == expectedCounts[depth - 1] else "FAIL (expected %d)" % expectedCounts[depth - 1]
+            if nodes != expectedCounts[depth - 1]:
+                failures += 1
+            print("%-10s depth %d: %9d %s" % (name, depth, nodes, status), file=out)
+    elapsed = time.perf_counter() - start
+    print("%d nodes in %.2fs (%.0f nodes/s), %d failures"
+          % (totalNodes, elapsed, totalNodes / max(elapsed, 1e-9), failures), file=out)
+    return failures
+
+
+def benchmark(repeat=20, perftDepth=3):
+    """
+    Throughput of the move generator over the test positions. Returns a dict of rates per second:
+    makeMove/undoMove pairs, getLegalMoves calls and perft leaf nodes.
+    """
+    states = [ChessEngine.GameState.fromFEN(fen) for _, fen, _ in TEST_POSITIONS]
+
+    start = time.perf_counter()
+    calls = 0
+    for _ in range(repeat):
+        for gs in states:
+            gs.getLegalMoves()
+            calls += 1
+    getLegalMovesRate = calls / (time.perf_counter() - start)
+
+    moveLists = [gs.getLegalMoves() for gs in states]
+    start = time.perf_counter()
+    pairs = 0
+    for _ in range(repeat):
+        for gs, moves in zip(states, moveLists):
+            for move in moves:
+                gs.makeMove(move)
+                gs.undoMove()
+            pairs += len(moves)
+    makeUndoRate = pairs / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    nodes = perft(ChessEngine.GameState.fromFEN(TEST_POSITIONS[0][1]), perftDepth)
+    perftRate = nodes / (time.perf_counter() - start)
+
+    return {"makeUndoPerSecond": round(makeUndoRate), "getLegalMovesPerSecond": round(getLegalMovesRate),
+            "perftNodesPerSecond": round(perftRate), "perftDepth": perftDepth}
+
+
+def recordBenchmark(results, path):
+    """
+    Append one benchmark result to a JSON lines file, so runs can be compared over time
+    """
+    record = dict(results, time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=sys.version.split()[0])
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft and move generator benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    perftParser = commands.add_parser("perft", help="count leaf nodes from one position")
+    perftParser.add_argument("depth", type=int)
+    perftParser.add_argument("--fen", default=TEST_POSITIONS[0][1])
+    perftParser.add_argument("--divide", action="store_true", help="show the count for each root move")
+    suiteParser = commands.add_parser("suite", help="check the counts of all test positions")
+    suiteParser.add_argument("--depth", type=int, default=3)
+    benchParser = commands.add_parser("bench", help="measure move generator throughput")
+    benchParser.add_argument("--repeat", type=int, default=20)
+    benchParser.add_argument("--record", metavar="FILE", help="append the result to a JSON lines file")
+    args = parser.parse_args(argv)
+
+    if args.command == "perft":
+        runPerft(ChessEngine.GameState.fromFEN(args.fen), args.depth, args.divide)
+    elif args.command == "suite":
+        return 1 if runSuite(args.depth) else 0
+    else:
+        results = benchmark(args.repeat)
+        print(json.dumps(results))
+        if args.record:
+            recordBenchmark(results, args.record)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
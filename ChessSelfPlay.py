@@ -0,0 +1,295 @@
+"""
+Self-play matches between two engine settings, or against another engine (e.g. an earlier version's
+ChessUCI.py) over UCI. Games run in parallel over a process pool. Every game is written to the PGN file and
+reported as soon as it ends, with the running Elo difference of the first player and its 95% error bars.
+
+    python ChessSelfPlay.py --games 100 --first movetime=200 --second nodes=5000
+    python ChessSelfPlay.py --first movetime=100 --second "uci=python ../old/ChessUCI.py,movetime=100"
+
+A player is a comma separated list of settings: movetime=MS, nodes=N and depth=N (without either limit it
+searches ChessAI.DEPTH plies), plus uci=COMMAND to play an engine over UCI instead of ChessAI.
+Each opening is played twice, once with each player as white.
+"""
+import argparse
+import math
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ChessAI
+import ChessAnalyze
+import ChessEngine
+
+# balanced opening lines the games start from, unless an openings file is given
+OPENING_LINES = [
+    "e2e4 e7e5 g1f3 b8c6",
+    "e2e4 c7c5 g1f3 d7d6",
+    "e2e4 e7e6 d2d4 d7d5",
+    "e2e4 c7c6 d2d4 d7d5",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 g8f6 c2c4 g7g6",
+    "c2c4 e7e5 b1c3 g8f6",
+    "g1f3 d7d5 g2g3 g8f6",
+]
+MAX_GAME_MOVES = 200  # moves by each side before a game is adjudicated a draw
+
+
+class EnginePlayer:
+    """
+    Plays with ChessAI.findBestMove in this process. Each player has its own transposition table and move
+    ordering, swapped into ChessAI for its own moves, so neither side searches with what the other learnt.
+    """
+
+    def __init__(self, timeLimit=None, nodeLimit=None, depth=None):
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.depth = depth
+        self.transpositionTable = ChessAI.TranspositionTable()
+        self.moveOrdering = ChessAI.KillerHistoryOrdering()
+
+    def newGame(self, fen):
+        self.transpositionTable.clear()
+        self.moveOrdering = ChessAI.KillerHistoryOrdering()
+
+    def chooseMove(self, gs, validMoves):
+        saved = ChessAI.transpositionTable, ChessAI.moveOrdering
+        ChessAI.transpositionTable, ChessAI.moveOrdering = self.transpositionTable, self.moveOrdering
+        try:
+            if self.depth is not None:
+                return ChessAI.findBestMoveIterative(gs, validMoves, self.timeLimit, self.nodeLimit, self.depth)
+            returnQueue = queue.Queue()
+            ChessAI.findBestMove(gs, validMoves, returnQueue, self.timeLimit, self.nodeLimit)
+            return returnQueue.get()
+        finally:
+            ChessAI.transpositionTable, ChessAI.moveOrdering = saved
+
+    def close(self):
+        pass
+
+
+class UCIPlayer:
+    """
+    Plays by asking an engine running as a UCI subprocess
+    """
+
+    def __init__(self, command, timeLimit=None, nodeLimit=None, depth=None):
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+        if timeLimit is not None:
+            self.goCommand = "go movetime %d" % timeLimit
+        elif nodeLimit is not None:
+            self.goCommand = "go nodes %d" % nodeLimit
+        else:
+            self.goCommand = "go depth %d" % (depth or ChessAI.DEPTH)
+        self.send("uci")
+        self.waitFor("uciok")
+        self.startFen = ChessEngine.START_FEN
+
+    def send(self, line):
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+
+    def waitFor(self, keyword):
+        """
+        Read engine output up to the line starting with keyword and return that line
+        """
+        for line in self.process.stdout:
+            if line.startswith(keyword):
+                return line
+        raise RuntimeError("UCI engine exited while waiting for " + keyword)
+
+    def newGame(self, fen):
+        self.startFen = fen
+        self.send("ucinewgame")
+        self.send("isready")
+        self.waitFor("readyok")
+
+    def chooseMove(self, gs, validMoves):
+        moves = " ".join(ChessEngine.Move.fromCode(move).getChessNotation() for move in gs.moveLog)
+        self.send("position fen %s moves %s" % (self.startFen, moves))
+        self.send(self.goCommand)
+        notation = self.waitFor("bestmove").split()[1]
+        for move in validMoves:
+            if move.getChessNotation() == notation:
+                return move
+        raise RuntimeError("UCI engine played an illegal move: " + notation)
+
+    def close(self):
+        self.send("quit")
+        self.process.wait()
+
+
+def makePlayer(spec):
+    settings = dict(item.split("=", 1) for item in spec.split(",") if item)
+    limits = {"timeLimit": int(settings["movetime"]) if "movetime" in settings else None,
+              "nodeLimit": int(settings["nodes"]) if "nodes" in settings else None,
+              "depth": int(settings["depth"]) if "depth" in settings else None}
+    if "uci" in settings:
+        return UCIPlayer(settings["uci"], **limits)
+    return EnginePlayer(**limits)
+
+
+def gameOverReason(gs, validMoves):
+    """
+    Why the game has ended and its result as (result, reason), or None while it goes on
+    """
+    if len(validMoves) == 0:
+        if gs.checkMate:
+            return ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    drawReason = gs.getDrawReason()
+    if drawReason is not None:
+        return "1/2-1/2", drawReason
+    return None
+
+
+def playGame(gameNumber, fen, whiteSpec, blackSpec, maxMoves=MAX_GAME_MOVES):
+    """
+    Play one game in a worker process. Returns (game number, result, reason, PGN text).
+    """
+    gs = ChessEngine.GameState.fromFEN(fen)
+    players = {"w": makePlayer(whiteSpec), "b": makePlayer(blackSpec)}
+    try:
+        for player in players.values():
+            player.newGame(fen)
+        sanMoves = []
+        while True:
+            validMoves = gs.getValidMoves()
+            ending = gameOverReason(gs, validMoves)
+            if ending is None and len(gs.moveLog) >= 2 * maxMoves:
+                ending = "1/2-1/2", "move limit"
+            if ending is not None:
+                break
+            move = players["w" if gs.whiteToMove else "b"].chooseMove(gs, validMoves)
+            sanMoves.append(gs.getSAN(move, validMoves))
+            gs.makeMove(move)
+    finally:
+        for player in players.values():
+            player.close()
+    result, reason = ending
+    return gameNumber, result, reason, formatPGN(gameNumber, fen, whiteSpec, blackSpec, sanMoves, result, reason)
+
+
+def formatPGN(gameNumber, fen, white, black, sanMoves, result, reason):
+    tags = [("Event", "Self-play"), ("Site", "?"), ("Date", time.strftime("%Y.%m.%d")), ("Round", str(gameNumber)),
+            ("White", white), ("Black", black), ("Result", result), ("Termination", reason)]
+    if fen != ChessEngine.START_FEN:
+        tags += [("SetUp", "1"), ("FEN", fen)]
+    gs = ChessEngine.GameState.fromFEN(fen)
+    moveNumber, whiteToMove = gs.fullmoveNumber, gs.whiteToMove
+    tokens = []
+    for i, san in enumerate(sanMoves):
+        if whiteToMove:
+            tokens.append("%d." % moveNumber)
+        elif i == 0:
+            tokens.append("%d..." % moveNumber)
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+    lines = []
+    line = ""
+    for token in tokens:  # PGN lines stay under 80 characters
+        if len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = token if not line else line + " " + token
+    lines.append(line)
+    return "".join('[%s "%s"]\n' % tag for tag in tags) + "\n" + "\n".join(lines) + "\n\n"
+
+
+def scoreToElo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+def eloDifference(wins, draws, losses):
+    """
+    The first player's Elo difference and 95% confidence interval from its game results, as (low, elo, high)
+    """
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return scoreToElo(score - margin), scoreToElo(score), scoreToElo(score + margin)
+
+
+def loadOpenings(path=None):
+    """
+    Opening FENs, one per line of the file (EPD lines work too), or the built in OPENING_LINES
+    """
+    if path is not None:
+        with open(path) as file:
+            # through a GameState, so EPD lines without move counters get them for the PGN FEN tag
+            return [ChessEngine.GameState.fromFEN(fen).toFEN() for _, fen, _ in ChessAnalyze.iterPositions(file)]
+    openings = []
+    for line in OPENING_LINES:
+        gs = ChessEngine.GameState.fromFEN(ChessEngine.START_FEN)
+        for notation in line.split():
+            gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == notation))
+        openings.append(gs.toFEN())
+    return openings
+
+
+def runMatch(games, first, second, openings, workers, pgnPath, maxMoves=MAX_GAME_MOVES, out=sys.stdout):
+    """
+    Play the games and return the first player's (wins, draws, losses). A game that fails is reported
+    and left out, the match goes on.
+    """
+    wins = draws = losses = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(pgnPath, "a") as pgnFile:
+        futures = {}
+        for gameNumber in range(1, games + 1):
+            fen = openings[(gameNumber - 1) // 2 % len(openings)]
+            firstIsWhite = gameNumber % 2 == 1
+            white, black = (first, second) if firstIsWhite else (second, first)
+            futures[executor.submit(playGame, gameNumber, fen, white, black, maxMoves)] = gameNumber, firstIsWhite
+        for finished, future in enumerate(as_completed(futures), 1):
+            gameNumber, firstIsWhite = futures[future]
+            try:
+                gameNumber, result, reason, pgn = future.result()
+            except Exception as error:
+                print("game %d (%d/%d) failed, %s: %s" % (gameNumber, finished, games, type(error).__name__, error),
+                      file=out, flush=True)
+                continue
+            pgnFile.write(pgn)
+            pgnFile.flush()
+            if result == "1/2-1/2":
+                draws += 1
+            elif (result == "1-0") == firstIsWhite:
+                wins += 1
+            else:
+                losses += 1
+            low, elo, high = eloDifference(wins, draws, losses)
+            print("game %d (%d/%d) %s %s, +%d =%d -%d, elo %.1f [%.1f, %.1f]"
+                  % (gameNumber, finished, games, result, reason, wins, draws, losses, elo, low, high),
+                  file=out, flush=True)
+    return wins, draws, losses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Self-play matches between two engine settings")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--first", default="movetime=200", help="settings of the player the Elo is given for")
+    parser.add_argument("--second", default="movetime=200")
+    parser.add_argument("--openings", metavar="FILE", help="FEN or EPD file of start positions")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pgn", default="selfplay.pgn", help="PGN file the games are appended to")
+    parser.add_argument("--max-moves", type=int, default=MAX_GAME_MOVES)
+    args = parser.parse_args(argv)
+    runMatch(args.games, args.first, args.second, loadOpenings(args.openings), args.workers, args.pgn,
+             args.max_moves)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+"""
+Endgame tablebases: the exact result and distance to mate of every position of an ending, generated here
+by retrograde analysis and probed by ChessAI at the root and at interior nodes with few pieces left.
+
+A table is one file per material signature (KQvK.tb, KRvKP.tb, ...) in a directory. It holds a 16 bit value
+per position, indexed by side to move and the square of each piece: 0 for a draw, plies to mate + 1
+otherwise (an odd number of plies is a win for the side to move, an even number a loss) and 0xFFFF for
+positions that can't occur. Tables are read through mmap and loaded the first time they are probed.
+Positions with the colors swapped (KvKQ) are looked up in the same table. Castling, en passant and the
+fifty move rule are ignored, so positions with castling rights are not probed.
+
+    python ChessTablebase.py generate tablebases              # all three piece endings, under a minute each
+    python ChessTablebase.py generate tablebases KRvKP KQvKR  # four piece endings take hours
+    python ChessTablebase.py probe tablebases --fen "8/8/8/4k3/8/8/8/3QK3 w - - 0 1"
+
+Generating a table also generates the tables of the endings it can turn into by captures and promotions.
+"""
+import argparse
+import itertools
+import mmap
+import os
+import sys
+from array import array
+from collections import OrderedDict
+
+import ChessEngine
+
+DRAW = 0
+INVALID = 0xFFFF
+CACHE_SIZE = 1 << 16  # probe results kept in the LRU cache
+THREE_PIECE_ENDINGS = ["KQvK", "KRvK", "KBvK", "KNvK", "KPvK"]
+PIECE_ORDER = "KQRBNP"
+PIECE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+TABLE_SUFFIX = ".tb"
+
+
+def squareRow(sq):
+    return sq // 8
+
+
+def buildTargets(steps, slide):
+    """
+    For every square, the squares reached by the (row, col) steps: a flat list, or one ray per step for sliders
+    """
+    targets = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        rays = []
+        for dr, dc in steps:
+            ray = []
+            nr, nc = r + dr, c + dc
+            while 0 <= nr < 8 and 0 <= nc < 8:
+                ray.append(nr * 8 + nc)
+                if not slide:
+                    break
+                nr, nc = nr + dr, nc + dc
+            if ray:
+                rays.append(ray)
+        targets.append(rays if slide else [ray[0] for ray in rays])
+    return targets
+
+
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KING_TARGETS = buildTargets(ORTHOGONAL + DIAGONAL, False)
+KNIGHT_TARGETS = buildTargets(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)), False)
+SLIDER_RAYS = {"R": buildTargets(ORTHOGONAL, True), "B": buildTargets(DIAGONAL, True),
+               "Q": buildTargets(ORTHOGONAL + DIAGONAL, True)}
+# squares a pawn of each color attacks from every square
+PAWN_ATTACKS = {"w": buildTargets(((-1, -1), (-1, 1)), False), "b": buildTargets(((1, -1), (1, 1)), False)}
+PAWN_STEP = {"w": -8, "b": 8}
+PROMOTION_ROW = {"w": 0, "b": 7}
+DOUBLE_STEP_ROW = {"w": 4, "b": 3}  # row a pawn lands on after its double step
+
+
+def flipSignature(signature):
+    white, black = signature.split("v")
+    return black + "v" + white
+
+
+def canonicalSignature(signature):
+    """
+    The signature the table of this ending is stored under: the side with more material is white
+    """
+    white, black = signature.split("v")
+    strength = lambda side: (len(side), sum(PIECE_VALUES[piece] for piece in side), side)
+    return signature if strength(white) >= strength(black) else flipSignature(signature)
+
+
+def sortSide(pieces):
+    return "".join(sorted(pieces, key=PIECE_ORDER.index))
+
+
+def signatureSlots(signature):
+    """
+    The (color, piece type) of every square in a table index: the kings first, then the other white pieces,
+    then the other black ones
+    """
+    white, black = signature.split("v")
+    return [("w", "K"), ("b", "K")] + [("w", piece) for piece in white[1:]] + [("b", piece) for piece in black[1:]]
+
+
+def makeSignature(pieces):
+    """
+    The signature of a list of (color, piece type, square)
+    """
+    white = sortSide(piece for color, piece, _ in pieces if color == "w")
+    black = sortSide(piece for color, piece, _ in pieces if color == "b")
+    return white + "v" + black
+
+
+def tableIndex(slots, pieces, blackToMove):
+    """
+    Index of the position with these (color, piece type, square) pieces in the table with these slots
+    """
+    remaining = list(pieces)
+    index = int(blackToMove)
+    for color, piece in slots:
+        for i, (pieceColor, pieceType, sq) in enumerate(remaining):
+            if pieceColor == color and pieceType == piece:
+                index = index * 64 + sq
+                del remaining[i]
+                break
+    return index
+
+
+def isAttacked(target, color, board, pieces):
+    """
+    Whether a piece of color among pieces [(color, piece type, square)] attacks target on board
+    (a list of 64 squares, None where empty)
+    """
+    for pieceColor, piece, sq in pieces:
+        if pieceColor != color:
+            continue
+        if piece == "K":
+            if target in KING_TARGETS[sq]:
+                return True
+        elif piece == "N":
+            if target in KNIGHT_TARGETS[sq]:
+                return True
+        elif piece == "P":
+            if target in PAWN_ATTACKS[color][sq]:
+                return True
+        else:
+            for ray in SLIDER_RAYS[piece][sq]:
+                for square in ray:
+                    if square == target:
+                        return True
+                    if board[square] is not None:
+                        break
+    return False
+
+
+def iterPieceMoves(color, piece, sq, board):
+    """
+    Yield (destination, promotion piece or None) for the pseudo legal moves of one piece
+    """
+    if piece == "K" or piece == "N":
+        for target in (KING_TARGETS if piece == "K" else KNIGHT_TARGETS)[sq]:
+            if board[target] is None or board[target][0] != color:
+                yield target, None
+    elif piece == "P":
+        targets = [target for target in PAWN_ATTACKS[color][sq]
+                   if board[target] is not None and board[target][0] != color]
+        ahead = sq + PAWN_STEP[color]
+        if board[ahead] is None:
+            targets.append(ahead)
+            twoAhead = ahead + PAWN_STEP[color]
+            if squareRow(twoAhead) == DOUBLE_STEP_ROW[color] and board[twoAhead] is None:
+                targets.append(twoAhead)
+        for target in targets:
+            if squareRow(target) == PROMOTION_ROW[color]:
+                for promotion in "QRBN":
+                    yield target, promotion
+            else:
+                yield target, None
+    else:
+        for ray in SLIDER_RAYS[piece][sq]:
+            for target in ray:
+                if board[target] is None:
+                    yield target, None
+                else:
+                    if board[target][0] != color:
+                        yield target, None
+                    break
+
+
+def iterUnmoveSources(color, piece, sq, board):
+    """
+    Yield the squares a piece now on sq could have come from with a move that neither captured nor promoted
+    """
+    if piece == "P":
+        behind = sq - PAWN_STEP[color]
+        if 0 <= behind < 64 and board[behind] is None:
+            yield behind
+            if squareRow(sq) == DOUBLE_STEP_ROW[color]:
+                twoBehind = behind - PAWN_STEP[color]
+                if board[twoBehind] is None:
+                    yield twoBehind
+    elif piece == "K" or piece == "N":
+        for source in (KING_TARGETS if piece == "K" else KNIGHT_TARGETS)[sq]:
+            if board[source] is None:
+                yield source
+    else:
+        for ray in SLIDER_RAYS[piece][sq]:
+            for source in ray:
+                if board[source] is not None:
+                    break
+                yield source
+
+
+class Tablebases:
+    """
+    Probes the tables in a directory, with the results of the latest probes kept in an LRU cache
+    """
+
+    def __init__(self, directory, cacheSize=CACHE_SIZE):
+        self.directory = directory
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()  # zobrist key -> probe result, least recently used first
+        self.tables = {}  # signature -> memoryview of the values, None when there is no file
+        self.files = []
+        signatures = [name[:-len(TABLE_SUFFIX)] for name in os.listdir(directory) if name.endswith(TABLE_SUFFIX)]
+        self.maxPieces = max((len(signature) - 1 for signature in signatures), default=0)
+
+    def getTable(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature + TABLE_SUFFIX)
+            if os.path.exists(path):
+                file = open(path, "rb")
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.files.append((file, data))
+                self.tables[signature] = memoryview(data).cast("H")
+            else:
+                self.tables[signature] = None
+        return self.tables[signature]
+
+    def probe(self, gs):
+        """
+        The result for the side to move as (1 win / 0 draw / -1 loss, plies to mate), or None when
+        the position isn't in the tables
+        """
+        key = gs.zobristKey
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        result = self.probePosition(gs)
+        self.cache[key] = result
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return result
+
+    def probePosition(self, gs):
+        if bin(gs.occupied).count("1") > self.maxPieces or gs.castlingRights:
+            return None
+        pieces = [(piece[0], piece[1], sq) for sq, piece in enumerate(gs.squares) if piece != "--"]
+        value = lookupValue(self.getTable, pieces, not gs.whiteToMove)
+        if value is None or value == INVALID:
+            return None
+        if value == DRAW:
+            return 0, 0
+        plies = value - 1
+        return (1 if plies % 2 else -1), plies
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.release()
+        for file, data in self.files:
+            data.close()
+            file.close()
+        self.tables = {}
+        self.files = []
+
+
+def lookupValue(getTable, pieces, blackToMove):
+    """
+    The stored value of a position given as (color, piece type, square) pieces, looked up with getTable
+    (signature -> values or None). DRAW for bare kings, None when the table is missing.
+    """
+    if len(pieces) == 2:
+        return DRAW
+    signature = makeSignature(pieces)
+    canonical = canonicalSignature(signature)
+    if canonical != signature:  # swap the colors and mirror the board
+        pieces = [("b" if color == "w" else "w", piece, sq ^ 56) for color, piece, sq in pieces]
+        blackToMove = not blackToMove
+    table = getTable(canonical)
+    if table is None:
+        return None
+    return table[tableIndex(signatureSlots(canonical), pieces, blackToMove)]
+
+
+def subSignatures(signature):
+    """
+    The endings this one turns into with a capture or a promotion
+    """
+    slots = signatureSlots(signature)
+    results = set()
+    for i, (color, piece) in enumerate(slots):
+        if piece == "K":
+            continue
+        others = [(c, p, 0) for j, (c, p) in enumerate(slots) if j != i]
+        results.add(canonicalSignature(makeSignature(others)))
+        if piece == "P":
+            for promotion in "QRBN":
+                promoted = others + [(color, promotion, 0)]
+                results.add(canonicalSignature(makeSignature(promoted)))
+                for j, (capturedColor, captured) in enumerate(slots):  # capturing and promoting at once
+                    if capturedColor != color and captured != "K":
+                        rest = [(c, p, 0) for k, (c, p) in enumerate(slots) if k != i and k != j]
+                        results.add(canonicalSignature(makeSignature(rest + [(color, promotion, 0)])))
+    results.discard("KvK")
+    return results
+
+
+def generateTable(signature, directory, tables=None, log=None):
+    """
+    Generate the table of signature, and the tables it depends on, into directory unless they are there already.
+    tables caches the values of generated tables by signature.
+    """
+    signature = canonicalSignature(signature)
+    if tables is None:
+        tables = {}
+    if signature in tables:
+        return tables[signature]
+    path = os.path.join(directory, signature + TABLE_SUFFIX)
+    if os.path.exists(path):
+        values = array("H")
+        with open(path, "rb") as file:
+            values.frombytes(file.read())
+        tables[signature] = values
+        return values
+    for subSignature in sorted(subSignatures(signature)):
+        generateTable(subSignature, directory, tables, log)
+    if log is not None:
+        log("generating " + signature)
+    values = solveTable(signature, tables.get)
+    tables[signature] = values
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as file:
+        values.tofile(file)
+    return values
+
+
+def solveTable(signature, getTable):
+    """
+    Retrograde analysis of one ending, with the tables of the endings it leads to read through getTable.
+    Returns the table values as an array.
+    """
+    slots = signatureSlots(signature)
+    count = len(slots)
+    size = 2 * 64 ** count
+    values = array("H", bytes(2 * size))
+    moveCounts = bytearray(size)  # legal moves that stay in this ending and aren't known to lose yet
+    exitWins = array("H", bytes(2 * size))  # plies to mate + 1 of the fastest win by leaving the ending
+    exitLosses = array("H", bytes(2 * size))  # plies to mate + 1 of the slowest loss by leaving the ending
+    exitDraws = bytearray(size)
+    buckets = [array("Q")]  # indexes of the positions to decide, by plies to mate
+
+    def schedule(index, plies):
+        while len(buckets) <= plies:
+            buckets.append(array("Q"))
+        buckets[plies].append(index)
+
+    # forward pass: count every position's moves and score the ones that leave the ending
+    board = [None] * 64
+    for blackToMove in (0, 1):
+        toMove, other = ("b", "w") if blackToMove else ("w", "b")
+        for offset, squares in enumerate(itertools.product(range(64), repeat=count)):
+            index = blackToMove * 64 ** count + offset
+            if len(set(squares)) < count:
+                values[index] = INVALID
+                continue
+            pieces = [(color, piece, sq) for (color, piece), sq in zip(slots, squares)]
+            if any(piece == "P" and squareRow(sq) in (0, 7) for _, piece, sq in pieces):
+                values[index] = INVALID
+                continue
+            for color, piece, sq in pieces:
+                board[sq] = (color, piece)
+            kingSquares = {"w": squares[0], "b": squares[1]}
+            if isAttacked(kingSquares[other], toMove, board, pieces):
+                values[index] = INVALID
+            else:
+                legalMoves = 0
+                for i, (color, piece, sq) in enumerate(pieces):
+                    if color != toMove:
+                        continue
+                    for target, promotion in list(iterPieceMoves(color, piece, sq, board)):
+                        captured = board[target]
+                        after = [p for p in pieces if p[2] != target and p[2] != sq]
+                        after.append((color, promotion or piece, target))
+                        board[sq] = None
+                        board[target] = (color, promotion or piece)
+                        kingSquare = target if piece == "K" else kingSquares[toMove]
+                        legal = not isAttacked(kingSquare, other, board, after)
+                        board[target] = captured
+                        board[sq] = (color, piece)
+                        if not legal:
+                            continue
+                        legalMoves += 1
+                        if captured is None and promotion is None:
+                            moveCounts[index] += 1
+                            continue
+                        value = lookupValue(getTable, after, not blackToMove)
+                        if value == DRAW:
+                            exitDraws[index] = 1
+                        elif (value - 1) % 2 == 0:  # the opponent loses: a win in one more ply
+                            if exitWins[index] == 0 or value + 1 < exitWins[index]:
+                                exitWins[index] = value + 1
+                        else:
+                            exitLosses[index] = max(exitLosses[index], value + 1)
+                if legalMoves == 0:
+                    if isAttacked(kingSquares[toMove], other, board, pieces):
+                        schedule(index, 0)  # checkmate
+                elif exitWins[index]:
+                    schedule(index, exitWins[index] - 1)
+                elif moveCounts[index] == 0 and not exitDraws[index]:
+                    schedule(index, exitLosses[index] - 1)
+            for _, _, sq in pieces:
+                board[sq] = None
+
+    # backward pass: decide positions in order of plies to mate, then find the moves that led to them
+    plies = 0
+    while plies < len(buckets):
+        for index in buckets[plies]:
+            if values[index] != DRAW:
+                continue  # already decided with fewer plies
+            values[index] = plies + 1
+            blackToMove, offset = divmod(index, 64 ** count)
+            squares = []
+            for _ in range(count):
+                offset, sq = divmod(offset, 64)
+                squares.append(sq)
+            squares.reverse()
+            mover = "w" if blackToMove else "b"
+            for sq in squares:
+                board[sq] = True
+            for i, (color, piece) in enumerate(slots):
+                if color != mover:
+                    continue
+                for source in list(iterUnmoveSources(color, piece, squares[i], board)):
+                    previous = 1 - blackToMove  # the same index layout as tableIndex
+                    for j, sq in enumerate(squares):
+                        previous = previous * 64 + (source if j == i else sq)
+                    if values[previous] != DRAW:
+                        continue
+                    if plies % 2 == 0:  # the side to move here loses, so moving here wins
+                        schedule(previous, plies + 1)
+                    else:
+                        moveCounts[previous] -= 1
+                        if moveCounts[previous] == 0 and not exitWins[previous] and not exitDraws[previous]:
+                            schedule(previous, max(plies + 1, exitLosses[previous] - 1))
+            for sq in squares:
+                board[sq] = None
+        buckets[plies] = None
+        plies += 1
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateParser = commands.add_parser("generate", help="generate tables into a directory")
+    generateParser.add_argument("directory")
+    generateParser.add_argument("endings", nargs="*", default=THREE_PIECE_ENDINGS,
+                                help="material signatures such as KRvKP (default: all three piece endings)")
+    probeParser = commands.add_parser("probe", help="probe a position")
+    probeParser.add_argument("directory")
+    probeParser.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        tables = {}
+        for signature in args.endings:
+            generateTable(signature, args.directory, tables, print)
+    else:
+        tablebases = Tablebases(args.directory)
+        gs = ChessEngine.GameState.fromFEN(args.fen)
+        result = tablebases.probe(gs)
+        if result is None:
+            print("not in the tablebases")
+        else:
+            print(("draw", "win", "loss")[result[0]] + ("" if result[0] == 0 else " in %d plies" % result[1]))
+        tablebases.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
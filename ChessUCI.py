@@ -0,0 +1,217 @@
+"""
+Headless UCI (Universal Chess Interface) driver, so tournament managers and other GUIs can run the engine
+as a subprocess over stdin/stdout. Nothing here needs pygame.
+
+    python ChessUCI.py
+
+Supported commands: uci, isready, ucinewgame, setoption name Hash value <MB>,
+setoption name BookFile value <path made by ChessBook.py, empty for none>,
+setoption name TablebasePath value <directory made by ChessTablebase.py, empty for none>, position startpos|fen <FEN>
+[moves ...], go [depth N] [movetime MS] [wtime MS btime MS winc MS binc MS movestogo N] [nodes N] [infinite],
+stop and quit.
+"""
+import sys
+import threading
+import time
+
+import ChessAI
+import ChessEngine
+
+ENGINE_NAME = "Chess-v1"
+ENGINE_AUTHOR = "Matthew Salyards"
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining clock time is shared over when the GUI doesn't say
+MOVE_OVERHEAD = 50  # milliseconds kept back from the clock for communication delays
+MIN_MOVE_TIME = 10
+
+
+def allocateTime(timeLeft, increment=0, movesToGo=None):
+    """
+    Milliseconds to think about this move when timeLeft is on the clock
+    """
+    budget = timeLeft / (movesToGo or DEFAULT_MOVES_TO_GO) + increment * 3 / 4
+    return max(MIN_MOVE_TIME, min(budget, timeLeft - MOVE_OVERHEAD))
+
+
+def formatScore(info):
+    """
+    The UCI score of a SearchInfo: centipawns, or moves to mate (counted along the PV) for mate
+    and tablebase scores
+    """
+    if abs(info.score) >= ChessAI.CHECKMATE:
+        moves = (len(info.pv) + 1) // 2
+        return "mate %d" % (moves if info.score > 0 else -moves)
+    if abs(info.score) > ChessAI.TABLEBASE_WIN - 1:  # a tablebase result, 1/1000 less for every ply to mate
+        plies = len(info.pv) + round((ChessAI.TABLEBASE_WIN - abs(info.score)) * 1000)
+        moves = (plies + 1) // 2
+        return "mate %d" % (moves if info.score > 0 else -moves)
+    return "cp %d" % round(info.score * 100)
+
+
+class UCIEngine:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outputLock = threading.Lock()  # info lines come from the search thread
+        self.gs = ChessEngine.GameState.fromFEN(ChessEngine.START_FEN)
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def run(self, lines=sys.stdin):
+        for line in lines:
+            if not self.handle(line):
+                break
+        self.stopSearch()
+
+    def handle(self, line):
+        """
+        Carry out one command. Returns False on quit.
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 1024" % ChessAI.HASH_SIZE_MB)
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            ChessAI.transpositionTable.clear()
+            self.gs = ChessEngine.GameState.fromFEN(ChessEngine.START_FEN)
+        elif command == "setoption":
+            self.setOption(args)
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(args)
+        elif command == "go":
+            self.stopSearch()
+            self.go(args)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            return False
+        return True
+
+    def setOption(self, args):
+        if "name" not in args or "value" not in args:
+            return
+        name = " ".join(args[args.index("name") + 1:args.index("value")])
+        value = " ".join(args[args.index("value") + 1:])
+        if name.lower() == "hash":
+            if not value.isdigit() or not 1 <= int(value) <= 1024:
+                self.send("info string Hash needs a whole number of MB from 1 to 1024, not " + value)
+                return
+            self.stopSearch()
+            ChessAI.transpositionTable = ChessAI.TranspositionTable(int(value))
+        elif name.lower() == "bookfile":
+            self.stopSearch()
+            try:
+                ChessAI.loadOpeningBook(value if value and value != "<empty>" else None)
+            except OSError:
+                ChessAI.loadOpeningBook(None)
+                self.send("info string cannot open book " + value)
+        elif name.lower() == "tablebasepath":
+            self.stopSearch()
+            try:
+                ChessAI.loadTablebases(value if value and value != "<empty>" else None)
+            except OSError:
+                ChessAI.loadTablebases(None)
+                self.send("info string cannot open tablebases in " + value)
+
+    def setPosition(self, args):
+        movesAt = args.index("moves") if "moves" in args else len(args)
+        if args and args[0] == "fen":
+            try:
+                gs = ChessEngine.GameState.fromFEN(" ".join(args[1:movesAt]))
+            except ValueError:
+                return  # keep the old position rather than playing on from a broken one
+        else:
+            gs = ChessEngine.GameState.fromFEN(ChessEngine.START_FEN)
+        for notation in args[movesAt + 1:]:
+            move = self.findMove(gs, notation)
+            if move is None:
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    @staticmethod
+    def findMove(gs, notation):
+        """
+        The legal move of gs written as notation in long algebraic form (e2e4, e7e8q), or None
+        """
+        notation = notation.lower()
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == notation:
+                return move
+        return None
+
+    def go(self, args):
+        options = {}
+        for i in range(len(args) - 1):
+            if args[i] in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes"):
+                try:
+                    options[args[i]] = int(args[i + 1])
+                except ValueError:
+                    self.send("info string ignoring %s %s" % (args[i], args[i + 1]))
+        infinite = "infinite" in args
+        timeLimit = options.get("movetime")
+        clock = options.get("wtime" if self.gs.whiteToMove else "btime")
+        if timeLimit is None and clock is not None and not infinite:
+            timeLimit = allocateTime(clock, options.get("winc" if self.gs.whiteToMove else "binc", 0),
+                                     options.get("movestogo"))
+        # without any limit a plain go searches the usual depth, the other limits deepen until they run out
+        limited = infinite or timeLimit is not None or "nodes" in options
+        maxDepth = options.get("depth", ChessAI.MAX_DEPTH if limited else ChessAI.DEPTH)
+        self.stopEvent = threading.Event()
+        self.searchThread = threading.Thread(target=self.search, daemon=True,
+                                             args=(self.gs, timeLimit, options.get("nodes"), maxDepth,
+                                                   self.stopEvent, infinite))
+        self.searchThread.start()
+
+    def search(self, gs, timeLimit, nodeLimit, maxDepth, stopEvent, infinite=False):
+        """
+        Runs in the search thread. An infinite search holds its bestmove back until stop, as UCI asks,
+        even when it has reached the greatest depth or found a mate.
+        """
+        startTime = time.perf_counter()
+
+        def sendInfo(info):
+            elapsed = int((time.perf_counter() - startTime) * 1000)
+            self.send("info depth %d score %s nodes %d nps %d time %d pv %s"
+                      % (info.depth, formatScore(info), info.nodes, info.nps, elapsed,
+                         " ".join(move.getChessNotation() for move in info.pv)))
+
+        move = ChessAI.getBookMove(gs)
+        if move is None:
+            validMoves = gs.getValidMoves()
+            move = ChessAI.findBestMoveIterative(gs, validMoves, timeLimit, nodeLimit, maxDepth, sendInfo,
+                                                 stopEvent)
+        if infinite:
+            stopEvent.wait()
+        self.send("bestmove " + ("0000" if move is None else move.getChessNotation()))
+
+    def stopSearch(self):
+        """
+        Stop a running search and wait for it to send its bestmove
+        """
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main():
+    UCIEngine().run()
+
+
+if __name__ == "__main__":
+    main()